@@ -0,0 +1,83 @@
+# مقارنة بناء الكيبورد بـ InlineKeyboardMarkup مع كل ضغطة مقابل القوالب الجاهزة
+# التشغيل: python benchmarks/bench_keyboards.py
+import os
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+# البوت يفتح ملفات البيانات في المجلد الحالي عند الاستيراد، فنشتغل في مجلد مؤقت
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.chdir(tempfile.mkdtemp())
+
+import جديد as app
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+BOTS = [{"name": f"بوت رقم {i}"} for i in range(10)]
+
+def legacy_main_menu():
+    markup = InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        InlineKeyboardButton("📁 ملفي", callback_data="my_profile"),
+        InlineKeyboardButton("📚 المكتبة", callback_data="library")
+    )
+    markup.add(
+        InlineKeyboardButton("👥 دعوة أصدقاء", callback_data="invite_friends"),
+        InlineKeyboardButton("📋 المهام", callback_data="tasks")
+    )
+    markup.add(
+        InlineKeyboardButton("⚙️ الإعدادات", callback_data="settings"),
+        InlineKeyboardButton("ℹ️ التعريف", callback_data="about")
+    )
+    markup.add(
+        InlineKeyboardButton("📩 شكوى", callback_data="complaint"),
+        InlineKeyboardButton("📊 الإحصائيات", callback_data="stats")
+    )
+    return markup.to_json()
+
+def cached_main_menu():
+    return app.keyboard("main_menu").to_json()
+
+def legacy_bots_page():
+    markup = InlineKeyboardMarkup()
+    for i, bot_item in enumerate(BOTS):
+        markup.row(InlineKeyboardButton(f"{bot_item['name']}", callback_data=f"view_bot_{i}"))
+    markup.row(
+        InlineKeyboardButton("⬅️ السابقة", callback_data="my_bots_page_1"),
+        InlineKeyboardButton("➡️ التالية", callback_data="my_bots_page_3")
+    )
+    markup.row(
+        InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
+        InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
+    )
+    return markup.to_json()
+
+def cached_bots_page():
+    return app.Keyboard(
+        *[app.row(app.button(f"{bot_item['name']}", f"view_bot_{i}")) for i, bot_item in enumerate(BOTS)],
+        *app.nav_row(app.button("⬅️ السابقة", "my_bots_page_1"), app.button("➡️ التالية", "my_bots_page_3")),
+        app.BACK_ROW
+    ).to_json()
+
+def peak_bytes(func):
+    # أعلى ذاكرة مؤقتة يحجزها استدعاء واحد
+    func()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return peak
+
+def report(name, legacy, cached, number=20000):
+    legacy_time = min(timeit.repeat(legacy, number=number, repeat=5)) / number * 1e6
+    cached_time = min(timeit.repeat(cached, number=number, repeat=5)) / number * 1e6
+    print(f"{name}: {legacy_time:.2f} µs -> {cached_time:.2f} µs ({legacy_time / cached_time:.1f}x), "
+          f"peak {peak_bytes(legacy)} B -> {peak_bytes(cached)} B")
+
+if __name__ == "__main__":
+    report("main_menu", legacy_main_menu, cached_main_menu)
+    report("my_bots page", legacy_bots_page, cached_bots_page)
@@ -0,0 +1,74 @@
+# ذاكرة بيانات المستخدمين المحملة: dict لكل مستخدم وبوت بمفاتيح نصية (الطريقة القديمة) مقابل UserRecord/BotRecord
+# بـ __slots__ ومفاتيح رقمية ونصوص مشتركة (sys.intern)، من نفس ملف users.jsonl
+# التشغيل: python benchmarks/bench_memory.py [عدد المستخدمين]
+import gc
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.chdir(tempfile.mkdtemp())
+
+import جديد as app
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+def make_data(users):
+    # نفس توزيع bench_startup: ثلث المستخدمين بدون بوتات، والوصف يتكرر بين المستخدمين
+    return {
+        "users": {1000 + i: app.UserRecord.from_dict({"points": i % 500, "referrals": i % 7, "bots": [
+            {"link": f"t.me/bot_{i}_{j}", "description": f"بوت تجريبي رقم {j}", "name": f"بوت {i} {j}"} for j in range(i % 3)
+        ]}) for i in range(users)},
+        "verified_bots": [app.make_bot_item({"link": f"t.me/verified_{i}", "description": "بوت معتمد", "name": f"معتمد {i}"})
+                          for i in range(100)],
+    }
+
+def load_dicts():
+    # مثل apply_journal_entry قبل السجلات المضغوطة: السطر كما هو من json
+    data = {"users": {}, "verified_bots": []}
+    with open(app.DATA_FILE, "r", encoding="utf-8") as f:
+        while True:
+            lines = list(itertools.islice(f, app.REPLAY_BATCH))
+            if not lines:
+                return data
+            for entry in json.loads("[" + ",".join(lines) + "]"):
+                if entry["op"] == "user":
+                    data["users"][entry["id"]] = entry["data"]
+                elif entry["op"] == "verified":
+                    data["verified_bots"].append(entry["data"])
+
+def load_records():
+    return app.JsonStorage(app.DATA_FILE, app.JOURNAL_FILE).read_data()[0]
+
+def measure(label, load):
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        data = load()
+        elapsed = time.perf_counter() - started
+        del data
+        tracemalloc.start()
+        data = load()
+        # الذاكرة اللي تبقى محجوزة بعد التحميل (مو الذروة أثناءه)
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    finally:
+        gc.enable()
+    print(f"{label}: {retained / 1024 / 1024:.1f} MB retained, {retained / len(data['users']):.0f} B/user, load {elapsed:.2f} s")
+    return retained
+
+def main():
+    app.write_jsonl_snapshot(make_data(USERS), app.DATA_FILE)
+    print(f"{app.DATA_FILE}: {os.path.getsize(app.DATA_FILE) / 1024 / 1024:.1f} MB, {USERS} users")
+    before = measure("dict per user/bot", load_dicts)
+    after = measure("__slots__ records", load_records)
+    print(f"saved: {(before - after) / 1024 / 1024:.1f} MB ({100 * (before - after) / before:.0f}%)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# زمن وذاكرة تحميل البيانات عند التشغيل: users.json القديم (json.load للملف كامل) مقابل users.jsonl (سطر سطر)
+# التشغيل: python benchmarks/bench_startup.py [عدد المستخدمين]
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.chdir(tempfile.mkdtemp())
+
+import جديد as app
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+def make_data(users):
+    return {
+        "users": {str(1000 + i): {"points": i % 500, "referrals": i % 7, "bots": [
+            {"link": f"t.me/bot_{i}_{j}", "description": f"بوت تجريبي رقم {j}", "name": f"بوت {i} {j}"} for j in range(i % 3)
+        ]} for i in range(users)},
+        "verified_bots": [{"link": f"t.me/verified_{i}", "description": "بوت معتمد", "name": f"معتمد {i}"} for i in range(100)],
+    }
+
+def measure(label, load):
+    # الزمن بدون tracemalloc (يبطئ التحميل أضعاف) والذاكرة في مرور ثاني
+    started = time.perf_counter()
+    data = load()
+    elapsed = time.perf_counter() - started
+    del data
+    tracemalloc.start()
+    data = load()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label}: {elapsed:.2f} s, peak {peak / 1024 / 1024:.0f} MB ({len(data['users'])} users)")
+
+def load_legacy():
+    with open(app.LEGACY_DATA_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def load_jsonl():
+    # مثل warm_up: بدون جامع الدورات أثناء التحميل
+    gc.disable()
+    try:
+        return app.JsonStorage(app.DATA_FILE, app.JOURNAL_FILE).read_data()[0]
+    finally:
+        gc.enable()
+
+def time_to_ready():
+    storage = app.JsonStorage(app.DATA_FILE, app.JOURNAL_FILE)
+    started = time.perf_counter()
+    storage.start()
+    accepting = time.perf_counter() - started
+    storage.ready.wait()
+    print(f"start(): accepting updates after {accepting * 1000:.1f} ms, data ready after {time.perf_counter() - started:.2f} s")
+
+def main():
+    with open(app.LEGACY_DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(make_data(USERS), f, ensure_ascii=False)
+    print(f"{app.LEGACY_DATA_FILE}: {os.path.getsize(app.LEGACY_DATA_FILE) / 1024 / 1024:.1f} MB")
+    measure("legacy json.load", load_legacy)
+    started = time.perf_counter()
+    app.migrate_legacy_data()
+    print(f"migration: {time.perf_counter() - started:.2f} s")
+    measure("jsonl streaming", load_jsonl)
+    time_to_ready()
+
+if __name__ == "__main__":
+    main()
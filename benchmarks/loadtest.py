@@ -0,0 +1,266 @@
+# اختبار حمل للبوت بدون تيليجرام: سيرفر Bot API وهمي + مستخدمين صناعيين
+# التشغيل: python benchmarks/loadtest.py --users 200 --latency 20 --rate-429 0.01
+# تسجيل التحديثات وإعادة تشغيلها: --record updates.jsonl ثم --replay updates.jsonl
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# سيرفر Bot API وهمي: تأخير قابل للضبط ونسبة ردود 429
+class FakeBotApi(BaseHTTPRequestHandler):
+    latency = 0.0
+    rate_429 = 0.0
+    lock = threading.Lock()
+    calls = {}
+    message_ids = itertools.count(1_000_000)
+    updates = []  # لوضع getUpdates
+    updates_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length") or 0)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if length:
+            params.update({key: values[0] for key, values in parse_qs(self.rfile.read(length).decode()).items()})
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getUpdates":
+            return self.reply(200, {"ok": True, "result": self.take_updates(params)})
+        if self.latency:
+            time.sleep(self.latency)
+        if self.rate_429 and random.random() < self.rate_429:
+            return self.reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                    "parameters": {"retry_after": 1}})
+        if method in ("sendMessage", "editMessageText"):
+            result = {"message_id": next(self.message_ids), "date": int(time.time()), "text": params.get("text", ""),
+                      "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}}
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        else:
+            result = True
+        self.reply(200, {"ok": True, "result": result})
+
+    def take_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.time() + min(float(params.get("timeout") or 0), 1.0)
+        while True:
+            with self.updates_lock:
+                batch = [update for update in self.updates if update["update_id"] >= offset][:limit]
+                self.updates[:] = [update for update in self.updates if update["update_id"] >= offset]
+            if batch or time.time() >= deadline:
+                return batch
+            time.sleep(0.01)
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# مستخدمين صناعيين: /start بإحالة، معالج إضافة بوت، بحث، صفحات، وشاشات الأدمن
+class Scenario:
+    def __init__(self, admin_id):
+        self.admin_id = admin_id
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        return {"update_id": next(self.update_ids), "message": {
+            "message_id": next(self.message_ids), "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}}
+
+    def callback(self, user_id, data):
+        return {"update_id": next(self.update_ids), "callback_query": {
+            "id": str(next(self.message_ids)), "chat_instance": str(user_id), "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "message": {"message_id": next(self.message_ids), "date": int(time.time()), "text": "menu",
+                        "chat": {"id": user_id, "type": "private"},
+                        "from": {"id": 1, "is_bot": True, "first_name": "loadtest"}}}}
+
+    def user_steps(self, user_id, referrer_id):
+        steps = [self.message(user_id, f"/start ref_{referrer_id}" if referrer_id else "/start")]
+        for i in range(2):
+            steps += [
+                self.callback(user_id, "library"),
+                self.callback(user_id, "add_bot"),
+                self.message(user_id, f"t.me/bot_{user_id}_{i}"),
+                self.message(user_id, f"بوت تجريبي رقم {i} للمكافآت"),
+                self.message(user_id, f"مكافأة {user_id} {i}"),
+                self.callback(user_id, "confirm_bot_link"),
+                self.callback(user_id, "confirm_bot_description"),
+                self.callback(user_id, "confirm_bot_name"),
+                self.callback(user_id, "confirm_add_bot"),
+                self.callback(user_id, "cancel_add_bot"),
+            ]
+        steps += [
+            self.callback(user_id, "search_bots"),
+            self.message(user_id, "مكافاه"),
+            self.callback(user_id, "search_page_2"),
+            self.callback(user_id, "my_bots_page_1"),
+            self.callback(user_id, "view_bot_0"),
+            self.callback(user_id, "go_back"),
+            self.callback(user_id, "my_profile"),
+            self.callback(user_id, "stats"),
+            self.callback(user_id, "main_menu"),
+        ]
+        return steps
+
+    def admin_steps(self):
+        return [self.callback(self.admin_id, data) for data in
+                ("admin_panel", "admin_view_bots", "admin_view_bots_all", "admin_users", "admin_users_id", "admin_stats")]
+
+    def build(self, users):
+        # نخلط خطوات المستخدمين بالتناوب عشان يشتغلوا بالتوازي مثل الواقع
+        flows = [self.user_steps(1000 + i, 1000 + i - 1 if i else None) for i in range(users)]
+        flows += [self.admin_steps() for _ in range(max(1, users // 20))]
+        updates = []
+        for step in itertools.zip_longest(*flows):
+            updates.extend(update for update in step if update is not None)
+        for i, update in enumerate(updates, 1):
+            update["update_id"] = i
+        return updates
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test جديد.py against a fake Bot API")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0, help="fake API latency per call in ms")
+    parser.add_argument("--rate-429", type=float, default=0, help="fraction of API calls answered with 429")
+    parser.add_argument("--batch", type=int, default=100, help="updates per batch (like getUpdates limit)")
+    parser.add_argument("--rate", type=float, default=0, help="updates/sec to feed (0 = as fast as possible)")
+    parser.add_argument("--polling", action="store_true", help="deliver updates through the fake getUpdates")
+    parser.add_argument("--real-limits", action="store_true", help="keep Telegram rate limits (default: lifted)")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--record", help="write the generated updates to a JSONL file")
+    parser.add_argument("--replay", help="replay updates from a JSONL file instead of generating them")
+    parser.add_argument("--timeout", type=float, default=30, help="stop waiting after this many seconds without progress")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    options = parser.parse_args()
+
+    FakeBotApi.latency = options.latency / 1000
+    FakeBotApi.rate_429 = options.rate_429
+    ThreadingHTTPServer.request_queue_size = 256
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # البوت يقرأ الإعدادات من البيئة عند الاستيراد ويكتب ملفاته في المجلد الحالي
+    os.environ.setdefault("BOT_TOKEN", "0:loadtest")
+    os.environ["STORAGE_BACKEND"] = options.storage
+    os.environ.setdefault("METRICS_PORT", "0")
+    if not options.real_limits:
+        os.environ.setdefault("GLOBAL_RATE", "1000000")
+        os.environ.setdefault("CHAT_RATE", "1000000")
+        os.environ.setdefault("CHAT_BURST", "1000000")
+    os.chdir(tempfile.mkdtemp(prefix="loadtest-"))
+    sys.path.insert(0, ROOT)
+    from telebot import apihelper, types
+    apihelper.API_URL = f"http://127.0.0.1:{server.server_port}/bot{{0}}/{{1}}"
+    import جديد as app
+
+    if options.replay:
+        with open(options.replay, encoding="utf-8") as f:
+            updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        updates = Scenario(app.ADMIN_IDS[0]).build(options.users)
+    if options.record:
+        with open(options.record, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(update, ensure_ascii=False) + "\n" for update in updates)
+
+    # نلتقط زمن كل تحديث من نقطة القياس الموجودة في البوت، والانتهاء من update_log.finish اللي يتنادى
+    # لكل تحديث حتى لو ما له هاندلر (edited_message، my_chat_member...). المكرر بنفس المعرف ينحسب مرة وحدة
+    latencies = []
+    finished = set()
+    expected = len({update["update_id"] for update in updates})
+    progress = {"at": time.time()}
+    done = threading.Event()
+    observe_update = app.metrics.observe_update
+    finish_update = app.update_log.finish
+
+    def record_update(update, route, latency, handler_seconds, deletes):
+        observe_update(update, route, latency, handler_seconds, deletes)
+        latencies.append(latency)
+
+    def record_finish(update_id):
+        finish_update(update_id)
+        finished.add(update_id)
+        progress["at"] = time.time()
+        if len(finished) >= expected:
+            done.set()
+
+    app.metrics.observe_update = record_update
+    app.update_log.finish = record_finish
+    app.start_services()
+    FakeBotApi.calls.clear()
+    rss_before = rss_bytes()
+    started = time.time()
+    progress["at"] = started
+
+    if options.polling:
+        with FakeBotApi.updates_lock:
+            FakeBotApi.updates.extend(updates)
+        threading.Thread(target=app.bot.polling, kwargs={"non_stop": True, "interval": 0, "timeout": 1}, daemon=True).start()
+    else:
+        for i in range(0, len(updates), options.batch):
+            if options.rate:
+                time.sleep(max(0.0, started + i / options.rate - time.time()))
+            app.bot.process_new_updates([types.Update.de_json(update) for update in updates[i:i + options.batch]])
+    # تحديث ما يخلص أبد (ضغطة مكررة بمعرف ثاني، أو ضاع) ما يعلق الاختبار: نوقف بعد --timeout بدون تقدم
+    while not done.wait(1):
+        if time.time() - progress["at"] > options.timeout:
+            break
+    elapsed = (time.time() if done.is_set() else progress["at"]) - started
+    if options.polling:
+        app.bot.stop_polling()
+
+    api_calls = sum(count for method, count in FakeBotApi.calls.items() if method != "getUpdates")
+    report = {
+        "updates": len(updates),
+        "completed": len(finished),
+        "missing": expected - len(finished),
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(len(finished) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "api_calls_per_update": round(api_calls / len(updates), 2),
+        "api_calls": dict(sorted(FakeBotApi.calls.items())),
+        "rss_growth_mb": round((rss_bytes() - rss_before) / 1024 / 1024, 1),
+    }
+    if options.json:
+        print(json.dumps(report, ensure_ascii=False))
+    else:
+        for key, value in report.items():
+            print(f"{key}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# استرجاع users.jsonl + users.journal بعد توقف مفاجئ أو فشل كتابة: ما يبقى سطر ناقص يضيّع التعديلات اللي بعده
+# التشغيل: python -m pytest -q tests
+import errno
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("METRICS_PORT", "0")
+os.chdir(tempfile.mkdtemp())
+
+import pytest
+
+import جديد as app
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / "users.jsonl"), str(tmp_path / "users.journal")
+
+def open_storage(paths):
+    storage = app.JsonStorage(*paths)
+    storage.load()
+    return storage
+
+def close_storage(storage):
+    storage.flush()
+    storage.journal.close()
+
+def write_users(paths, *user_ids):
+    storage = open_storage(paths)
+    for user_id in user_ids:
+        storage.add_points(user_id, 10)
+    close_storage(storage)
+
+def tear_journal(paths, tail):
+    with open(paths[1], "a", encoding="utf-8") as f:
+        f.write(tail)
+
+def user_ids(storage):
+    return sorted(storage.data["users"])
+
+@pytest.mark.parametrize("tail", ['{"op": "user", "id": "9", "da', '{"op": "user", "id": "9", "data": {"points": 1}}'])
+def test_writes_after_torn_tail_survive_restart(paths, tail):
+    write_users(paths, 1, 2)
+    tear_journal(paths, tail)
+    storage = open_storage(paths)
+    storage.add_points(3, 10)
+    close_storage(storage)
+    storage = open_storage(paths)
+    assert 3 in storage.data["users"]
+    assert storage.data["users"][3].points == 10
+    assert {1, 2} <= set(storage.data["users"])
+    close_storage(storage)
+
+def test_writes_after_torn_tail_survive_compaction(paths):
+    write_users(paths, 1, 2)
+    tear_journal(paths, '{"op": "user", "id": "9", "da')
+    storage = open_storage(paths)
+    storage.add_points(3, 10)
+    storage.compact()
+    close_storage(storage)
+    assert not os.path.exists(paths[1] + ".old")
+    storage = open_storage(paths)
+    assert user_ids(storage) == [1, 2, 3]
+    close_storage(storage)
+
+def test_clean_journal_is_kept(paths):
+    write_users(paths, 1)
+    size = os.path.getsize(paths[1])
+    storage = open_storage(paths)
+    assert os.path.getsize(paths[1]) == size
+    assert user_ids(storage) == [1]
+    close_storage(storage)
+
+class FailingJournal:
+    # قرص ممتلئ بنص الكتابة: نص الدفعة ينكتب ثم OSError
+    def __init__(self, journal):
+        self.journal = journal
+
+    def write(self, text):
+        self.journal.write(text[:len(text) // 2])
+        self.journal.flush()
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    def __getattr__(self, name):
+        return getattr(self.journal, name)
+
+def test_failed_write_is_retried_without_partial_lines(paths):
+    storage = open_storage(paths)
+    storage.add_points(1, 10)
+    storage.add_points(2, 10)
+    storage.journal = FailingJournal(storage.journal)
+    with pytest.raises(OSError):
+        storage.flush()
+    assert os.path.getsize(paths[1]) == 0
+    storage.add_points(2, 5)
+    close_storage(storage)
+    with open(paths[1], encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2
+    storage = open_storage(paths)
+    assert storage.data["users"][1].points == 10
+    assert storage.data["users"][2].points == 15
+    close_storage(storage)
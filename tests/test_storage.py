@@ -0,0 +1,48 @@
+# سلوك مشترك بين تخزين JSON وSQLite
+# التشغيل: python -m pytest -q tests
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("METRICS_PORT", "0")
+os.chdir(tempfile.mkdtemp())
+
+import pytest
+
+import جديد as app
+
+@pytest.fixture(params=["json", "sqlite"])
+def storage(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    if request.param == "json":
+        storage = app.JsonStorage(str(tmp_path / "users.jsonl"), str(tmp_path / "users.journal"))
+    else:
+        storage = app.SqliteStorage(str(tmp_path / "users.db"))
+    storage.load()
+    storage.build_search_index()
+    storage.rebuild_stats()
+    return storage
+
+def add_bots(storage, user_id, *names):
+    for name in names:
+        storage.add_bot(user_id, {"link": f"t.me/{name}", "description": f"وصف {name}", "name": name})
+    return {bot_item["name"]: doc_id for doc_id, owner, _, bot_item in storage.page_bots(unverified_only=False)}
+
+def test_verify_by_id_survives_deletes_before_it(storage):
+    ids = add_bots(storage, 5, "a", "b", "c")
+    storage.delete_bot(5, 0)
+    assert storage.verify_bot(5, ids["b"])["name"] == "b"
+    assert [bot_item["name"] for bot_item in storage.get_bots(5)] == ["c"]
+    assert [bot_item["name"] for bot_item in storage.get_verified_bots()] == ["b"]
+
+def test_verify_missing_bot_returns_none(storage):
+    ids = add_bots(storage, 5, "a", "b")
+    storage.delete_bot(5, 1)
+    assert storage.verify_bot(5, ids["b"]) is None
+    assert storage.verify_bot(6, ids["a"]) is None
+    assert storage.verify_bot(5, ids["a"])["name"] == "a"
+    assert storage.verify_bot(5, ids["a"]) is None
+    assert storage.stats.snapshot()["verified"] == 1
@@ -1,856 +1,3426 @@
-import logging
-import telebot
-import requests
-import json
-import os
-import time
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from requests.exceptions import ConnectionError, ReadTimeout
-
-# إعدادات التسجيل
-logging.basicConfig(
-    filename="log.txt",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
-
-# التحقق من التوكن
-try:
-    TOKEN = os.getenv("BOT_TOKEN")
-    if not TOKEN:
-        print("❌ خطأ: لم يتم العثور على التوكن!")
-        logging.error("لم يتم العثور على التوكن!")
-        exit()
-except Exception as e:
-    logging.error(f"خطأ في جلب التوكن: {e}")
-    print(f"خطأ في جلب التوكن: {e}")
-    exit()
-
-# إنشاء البوت
-try:
-    bot = telebot.TeleBot(TOKEN)
-    logging.info("البوت بدأ يشتغل")
-except Exception as e:
-    logging.error(f"خطأ في إنشاء البوت: {e}")
-    print(f"خطأ في إنشاء البوت: {e}")
-    exit()
-
-# المتغيرات العامة
-last_messages = {}
-page_history = {}
-user_states = {}
-user_inputs = {}
-pagination_state = {}
-
-DATA_FILE = "users.json"
-global_data = None
-
-# تحميل البيانات
-try:
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "w") as f:
-            json.dump({"users": {}, "verified_bots": []}, f)
-    with open(DATA_FILE, "r") as f:
-        global_data = json.load(f)
-except Exception as e:
-    logging.error(f"خطأ في إنشاء أو تحميل ملف البيانات: {e}")
-    print(f"خطأ في إنشاء أو تحميل ملف البيانات: {e}")
-    exit()
-
-ADMIN_IDS = [7920989999]  # قائمة معرفات الأدمن
-
-# دوال مساعدة
-def save_data():
-    try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(global_data, f)
-    except Exception as e:
-        logging.error(f"خطأ في حفظ البيانات: {e}")
-
-def get_rank(points):
-    try:
-        if points >= 100:
-            return "محترف"
-        elif points >= 50:
-            return "متوسط"
-        else:
-            return "مبتدئ"
-    except Exception as e:
-        logging.error(f"خطأ في تحديد الرتبة: {e}")
-        return "مبتدئ"
-
-def delete_previous_messages(chat_id, user_id):
-    try:
-        if user_id in last_messages:
-            messages_to_delete = last_messages[user_id][-10:]
-            for message_id in messages_to_delete:
-                try:
-                    bot.delete_message(chat_id, message_id)
-                except Exception:
-                    pass
-        last_messages[user_id] = []
-    except Exception as e:
-        logging.error(f"خطأ في مسح الرسائل القديمة لـ {user_id}: {e}")
-
-def add_message_to_history(chat_id, user_id, message_id):
-    try:
-        if user_id not in last_messages:
-            last_messages[user_id] = []
-        last_messages[user_id].append(message_id)
-    except Exception as e:
-        logging.error(f"خطأ في إضافة رسالة للتاريخ لـ {user_id}: {e}")
-
-def add_to_page_history(user_id, page):
-    if user_id not in page_history:
-        page_history[user_id] = []
-    if not page_history[user_id] or page_history[user_id][-1] != page:
-        page_history[user_id].append(page)
-
-# القوائم
-def main_menu(chat_id, user_id):
-    start_time = time.time()
-    try:
-        delete_previous_messages(chat_id, user_id)
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("📁 ملفي", callback_data="my_profile"),
-            InlineKeyboardButton("📚 المكتبة", callback_data="library")
-        )
-        markup.add(
-            InlineKeyboardButton("👥 دعوة أصدقاء", callback_data="invite_friends"),
-            InlineKeyboardButton("📋 المهام", callback_data="tasks")
-        )
-        markup.add(
-            InlineKeyboardButton("⚙️ الإعدادات", callback_data="settings"),
-            InlineKeyboardButton("ℹ️ التعريف", callback_data="about")
-        )
-        markup.add(
-            InlineKeyboardButton("📩 شكوى", callback_data="complaint"),
-            InlineKeyboardButton("📊 الإحصائيات", callback_data="stats")
-        )
-        if user_id in ADMIN_IDS:
-            markup.add(InlineKeyboardButton("🛠️ لوحة الأدمن", callback_data="admin_panel"))
-        
-        msg = bot.send_message(chat_id, "مرحبًا بك في البوت! اختر خيارًا:", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        page_history[user_id] = ["main_menu"]
-    except Exception as e:
-        logging.error(f"فشل في إرسال القايمة الرئيسية لـ {user_id}: {e}")
-    finally:
-        duration = time.time() - start_time
-        if duration > 2:
-            logging.warning(f"تأخير في إرسال القايمة الرئيسية لـ {user_id}: {duration} ثانية")
-
-def library_menu(chat_id, user_id):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("➕ إضافة بوت", callback_data="add_bot"),
-            InlineKeyboardButton("📜 بوتاتي", callback_data="my_bots_page_1")
-        )
-        markup.add(
-            InlineKeyboardButton("✅ البوتات المعتمدة", callback_data="verified_bots"),
-            InlineKeyboardButton("🔍 بحث", callback_data="search_bots")
-        )
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, "📚 المكتبة:", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "library")
-    except Exception as e:
-        logging.error(f"فشل في إرسال قايمة المكتبة لـ {user_id}: {e}")
-
-def search_bots(chat_id, user_id):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        markup = InlineKeyboardMarkup()
-        markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_search"))
-        msg = bot.send_message(chat_id, "🔍 أرسل كلمة للبحث عن بوت (بالاسم أو الوصف):", reply_markup=markup)
-        user_states[user_id] = "searching_bots"
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "search_bots")
-    except Exception as e:
-        logging.error(f"فشل في بدء البحث لـ {user_id}: {e}")
-
-def show_search_results(chat_id, user_id, query):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        user_data = global_data["users"].get(str(user_id), {"bots": []})
-        bots = user_data.get("bots", [])
-        
-        results = [(i, bot) for i, bot in enumerate(bots) if query.lower() in bot["name"].lower() or query.lower() in bot["description"].lower()]
-        
-        if not results:
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-            )
-            msg = bot.send_message(chat_id, "❌ لا توجد نتائج مطابقة!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            return
-        
-        markup = InlineKeyboardMarkup()
-        for bot_index, bot_item in results:
-            markup.row(InlineKeyboardButton(f"{bot_item['name']}", callback_data=f"view_bot_{bot_index}"))
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, f"🔍 نتائج البحث عن '{query}':", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "search_results")
-    except Exception as e:
-        logging.error(f"فشل في عرض نتائج البحث لـ {user_id}: {e}")
-
-def my_bots_menu(chat_id, user_id, page=1):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        user_data = global_data["users"].get(str(user_id), {"bots": []})
-        bots = user_data.get("bots", [])
-        
-        if not bots:
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-            )
-            msg = bot.send_message(chat_id, "📜 لا يوجد بوتات مضافة!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            return
-        
-        items_per_page = 10
-        total_pages = (len(bots) + items_per_page - 1) // items_per_page
-        page = max(1, min(page, total_pages))
-        start_idx = (page - 1) * items_per_page
-        end_idx = start_idx + items_per_page
-        current_bots = bots[start_idx:end_idx]
-        
-        markup = InlineKeyboardMarkup()
-        for i, bot_item in enumerate(current_bots):
-            bot_idx = start_idx + i
-            markup.row(InlineKeyboardButton(f"{bot_item['name']}", callback_data=f"view_bot_{bot_idx}"))
-        
-        nav_buttons = []
-        if page > 1:
-            nav_buttons.append(InlineKeyboardButton("⬅️ السابقة", callback_data=f"my_bots_page_{page-1}"))
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton("➡️ التالية", callback_data=f"my_bots_page_{page+1}"))
-        if nav_buttons:
-            markup.row(*nav_buttons)
-        
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, f"📜 بوتاتك (الصفحة {page} من {total_pages}):", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "my_bots")
-        pagination_state[user_id] = page
-    except Exception as e:
-        logging.error(f"فشل في إرسال قايمة بوتاتي لـ {user_id}: {e}")
-
-def view_bot_details(chat_id, user_id, bot_index):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        user_data = global_data["users"].get(str(user_id), {"bots": []})
-        bots = user_data.get("bots", [])
-        
-        if bot_index >= len(bots):
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-            )
-            msg = bot.send_message(chat_id, "❌ البوت غير موجود!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            return
-        
-        bot_item = bots[bot_index]
-        markup = InlineKeyboardMarkup()
-        markup.row(
-            InlineKeyboardButton("🔗 فتح البوت", url=bot_item["link"]),
-            InlineKeyboardButton("ℹ️ معلومات", callback_data=f"show_bot_info_{bot_index}")
-        )
-        markup.row(
-            InlineKeyboardButton("✏️ تعديل", callback_data=f"edit_bot_{bot_index}"),
-            InlineKeyboardButton("🗑️ حذف", callback_data=f"confirm_delete_bot_{bot_index}")
-        )
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, f"🤖 {bot_item['name']}", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "view_bot")
-    except Exception as e:
-        logging.error(f"فشل في عرض تفاصيل البوت لـ {user_id}: {e}")
-
-def show_bot_info(chat_id, user_id, bot_index):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        user_data = global_data["users"].get(str(user_id), {"bots": []})
-        bots = user_data.get("bots", [])
-        bot_item = bots[bot_index]
-        markup = InlineKeyboardMarkup()
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        msg = bot.send_message(chat_id, f"ℹ️ معلومات {bot_item['name']}:\n{bot_item['description']}", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "show_bot_info")
-    except Exception as e:
-        logging.error(f"فشل في عرض معلومات البوت لـ {user_id}: {e}")
-
-def admin_panel(chat_id, user_id):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("📚 إدارة المكتبة", callback_data="admin_library"),
-            InlineKeyboardButton("👤 إدارة المستخدمين", callback_data="admin_users")
-        )
-        markup.add(
-            InlineKeyboardButton("📋 إدارة المهام", callback_data="admin_tasks"),
-            InlineKeyboardButton("📊 إحصائيات المشروع", callback_data="admin_stats")
-        )
-        markup.add(
-            InlineKeyboardButton("🗑️ تنظيف القروب", callback_data="admin_clean"),
-            InlineKeyboardButton("⚙️ الإعدادات", callback_data="admin_settings")
-        )
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, "🛠️ لوحة الأدمن:", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "admin_panel")
-    except Exception as e:
-        logging.error(f"فشل في إرسال لوحة الأدمن لـ {user_id}: {e}")
-
-def admin_library_menu(chat_id, user_id):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("📜 عرض البوتات", callback_data="admin_view_bots"),
-            InlineKeyboardButton("✅ اعتماد بوت", callback_data="admin_verify_bot")
-        )
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, "📚 إدارة المكتبة:", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "admin_library")
-    except Exception as e:
-        logging.error(f"فشل في إرسال إدارة المكتبة لـ {user_id}: {e}")
-
-def admin_view_bots(chat_id, user_id):
-    try:
-        delete_previous_messages(chat_id, user_id)
-        all_bots = []
-        for uid, user_data in global_data["users"].items():
-            bots = user_data.get("bots", [])
-            for i, bot_item in enumerate(bots):
-                all_bots.append((uid, i, bot_item))
-        
-        if not all_bots:
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-            )
-            msg = bot.send_message(chat_id, "📜 لا يوجد بوتات مضافة!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            return
-        
-        markup = InlineKeyboardMarkup()
-        for uid, bot_index, bot_item in all_bots:
-            markup.row(
-                InlineKeyboardButton(f"{bot_item['name']} (المستخدم: {uid})", callback_data=f"view_admin_bot_{uid}_{bot_index}"),
-                InlineKeyboardButton("✅ اعتماد", callback_data=f"verify_bot_{uid}_{bot_index}")
-            )
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        msg = bot.send_message(chat_id, "📜 البوتات المضافة:", reply_markup=markup)
-        add_message_to_history(chat_id, user_id, msg.message_id)
-        add_to_page_history(user_id, "admin_view_bots")
-    except Exception as e:
-        logging.error(f"فشل في عرض البوتات للأدمن لـ {user_id}: {e}")
-
-# معالجة الأوامر
-@bot.message_handler(commands=['start'])
-def command_start(message):
-    try:
-        chat_id = message.chat.id
-        user_id = message.from_user.id
-        delete_previous_messages(chat_id, user_id)
-        bot.delete_message(chat_id, message.message_id)
-        
-        args = message.text.split()
-        if len(args) > 1 and args[1].startswith("ref_"):
-            referrer_id = args[1].split("_")[1]
-            if referrer_id != str(user_id):
-                if str(user_id) not in global_data["users"]:
-                    global_data["users"][str(user_id)] = {"points": 0, "referrals": 0, "bots": []}
-                    if str(referrer_id) in global_data["users"]:
-                        global_data["users"][str(referrer_id)]["referrals"] += 1
-                        global_data["users"][str(referrer_id)]["points"] += 10
-                        save_data()
-                        bot.send_message(int(referrer_id), "🎉 صديق جديد انضم برابطك! +10 نقاط")
-        
-        if str(user_id) not in global_data["users"]:
-            global_data["users"][str(user_id)] = {"points": 0, "referrals": 0, "bots": []}
-            save_data()
-        
-        main_menu(chat_id, user_id)
-    except Exception as e:
-        logging.error(f"خطأ في معالجة /start لـ {user_id}: {e}")
-
-# معالجة الضغطات
-@bot.callback_query_handler(func=lambda call: True)
-def callback_handler(call):
-    try:
-        chat_id = call.message.chat.id
-        user_id = call.from_user.id
-        delete_previous_messages(chat_id, user_id)
-        
-        markup = InlineKeyboardMarkup()
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        if call.data == "main_menu":
-            main_menu(chat_id, user_id)
-        elif call.data == "go_back":
-            if user_id in page_history and len(page_history[user_id]) > 1:
-                page_history[user_id].pop()
-                previous_page = page_history[user_id][-1]
-                if previous_page == "main_menu":
-                    main_menu(chat_id, user_id)
-                elif previous_page == "library":
-                    library_menu(chat_id, user_id)
-                elif previous_page == "my_bots":
-                    page = pagination_state.get(user_id, 1)
-                    my_bots_menu(chat_id, user_id, page)
-                elif previous_page == "admin_panel":
-                    admin_panel(chat_id, user_id)
-                elif previous_page == "admin_library":
-                    admin_library_menu(chat_id, user_id)
-                elif previous_page == "admin_view_bots":
-                    admin_view_bots(chat_id, user_id)
-                elif previous_page == "view_bot":
-                    bot_index = user_inputs.get(user_id, {}).get("bot_index", 0)
-                    view_bot_details(chat_id, user_id, bot_index)
-                else:
-                    main_menu(chat_id, user_id)
-            else:
-                main_menu(chat_id, user_id)
-        elif call.data == "my_profile":
-            user_data = global_data["users"].get(str(user_id), {"points": 0, "referrals": 0})
-            user_name = call.from_user.first_name or "مستخدم"
-            username = call.from_user.username or "غير متاح"
-            points = user_data["points"]
-            referrals = user_data["referrals"]
-            rank = get_rank(points)
-            profile_text = (
-                f"📁 ملفك الشخصي:\n"
-                f"الاسم: {user_name}\n"
-                f"المعرف: @{username}\n"
-                f"ID: {user_id}\n"
-                f"نقاطك: {points}\n"
-                f"رتبتك: {rank}\n"
-                f"إحالاتك: {referrals}"
-            )
-            msg = bot.send_message(chat_id, profile_text, reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "my_profile")
-        elif call.data == "library":
-            library_menu(chat_id, user_id)
-        elif call.data == "search_bots":
-            search_bots(chat_id, user_id)
-        elif call.data == "cancel_search":
-            library_menu(chat_id, user_id)
-        elif call.data == "add_bot":
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-            msg = bot.send_message(chat_id, "📝 أرسل لينك البوت (مثال: t.me/bot):", reply_markup=markup)
-            user_states[user_id] = "adding_bot_link"
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "add_bot")
-        elif call.data.startswith("my_bots_page_"):
-            page = int(call.data.split("_")[-1])
-            my_bots_menu(chat_id, user_id, page)
-        elif call.data.startswith("view_bot_"):
-            bot_index = int(call.data.split("_")[-1])
-            user_inputs[user_id] = {"bot_index": bot_index}
-            view_bot_details(chat_id, user_id, bot_index)
-        elif call.data.startswith("show_bot_info_"):
-            bot_index = int(call.data.split("_")[-1])
-            user_inputs[user_id] = {"bot_index": bot_index}
-            show_bot_info(chat_id, user_id, bot_index)
-        elif call.data.startswith("edit_bot_"):
-            bot_index = int(call.data.split("_")[-1])
-            user_inputs[user_id] = {"bot_index": bot_index}
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-            msg = bot.send_message(chat_id, "📝 أرسل لينك البوت الجديد (مثال: t.me/bot):", reply_markup=markup)
-            user_states[user_id] = "editing_bot_link"
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "edit_bot")
-        elif call.data.startswith("confirm_delete_bot_"):
-            bot_index = int(call.data.split("_")[-1])
-            user_inputs[user_id] = {"bot_index": bot_index}
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("✅ تأكيد الحذف", callback_data=f"delete_bot_{bot_index}"),
-                InlineKeyboardButton("❌ إلغاء", callback_data="cancel_delete_bot")
-            )
-            msg = bot.send_message(chat_id, "⚠️ هل أنت متأكد من حذف هذا البوت؟", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "confirm_delete_bot")
-        elif call.data.startswith("delete_bot_"):
-            bot_index = int(call.data.split("_")[-1])
-            user_data = global_data["users"].get(str(user_id), {"bots": []})
-            user_data["bots"].pop(bot_index)
-            global_data["users"][str(user_id)] = user_data
-            save_data()
-            msg = bot.send_message(chat_id, "🗑️ تم حذف البوت بنجاح!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "cancel_delete_bot":
-            bot_index = user_inputs.get(user_id, {}).get("bot_index", 0)
-            view_bot_details(chat_id, user_id, bot_index)
-        elif call.data == "cancel_add_bot":
-            user_states.pop(user_id, None)
-            user_inputs.pop(user_id, None)
-            library_menu(chat_id, user_id)
-        elif call.data == "confirm_bot_link":
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("✅ تأكيد", callback_data="confirm_bot_description"),
-                InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_link"),
-                InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-            )
-            bot_link = user_inputs.get(user_id, {}).get("link", "")
-            msg = bot.send_message(chat_id, f"📝 لينك البوت:\n{bot_link}", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "edit_bot_link":
-            user_states[user_id] = "editing_bot_link"
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-            msg = bot.send_message(chat_id, "📝 أرسل لينك البوت الجديد (مثال: t.me/bot):", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "confirm_bot_description":
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("✅ تأكيد", callback_data="confirm_bot_name"),
-                InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_description"),
-                InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-            )
-            bot_description = user_inputs.get(user_id, {}).get("description", "")
-            msg = bot.send_message(chat_id, f"📝 وصف البوت:\n{bot_description}", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "edit_bot_description":
-            user_states[user_id] = "editing_bot_description"
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-            msg = bot.send_message(chat_id, "📝 أرسل وصف البوت الجديد:", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "confirm_bot_name":
-            markup = InlineKeyboardMarkup()
-            markup.row(
-                InlineKeyboardButton("✅ تأكيد", callback_data="confirm_add_bot"),
-                InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_name"),
-                InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-            )
-            bot_name = user_inputs.get(user_id, {}).get("name", "")
-            msg = bot.send_message(chat_id, f"📝 اسم البوت:\n{bot_name}", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "edit_bot_name":
-            user_states[user_id] = "editing_bot_name"
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-            msg = bot.send_message(chat_id, "📝 أرسل اسم البوت الجديد:", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "confirm_add_bot":
-            user_data = global_data["users"].get(str(user_id), {"bots": []})
-            bot_info = user_inputs.get(user_id, {})
-            if "bot_index" in bot_info:  # تعديل بوت موجود
-                bot_index = bot_info["bot_index"]
-                user_data["bots"][bot_index] = {"link": bot_info["link"], "description": bot_info["description"], "name": bot_info["name"]}
-            else:  # إضافة بوت جديد
-                user_data.setdefault("bots", []).append(bot_info)
-            global_data["users"][str(user_id)] = user_data
-            save_data()
-            user_states.pop(user_id, None)
-            user_inputs.pop(user_id, None)
-            msg = bot.send_message(chat_id, "✅ تمت العملية بنجاح!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "verified_bots":
-            verified_bots = global_data.get("verified_bots", [])
-            if not verified_bots:
-                msg = bot.send_message(chat_id, "✅ لا يوجد بوتات معتمدة!", reply_markup=markup)
-            else:
-                bots_text = "\n".join([f"{i+1}. {bot['name']} - {bot['description']}" for i, bot in enumerate(verified_bots)])
-                msg = bot.send_message(chat_id, f"✅ البوتات المعتمدة:\n{bots_text}", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "invite_friends":
-            referral_link = f"https://t.me/{bot.get_me().username}?start=ref_{user_id}"
-            user_data = global_data["users"].get(str(user_id), {"points": 0, "referrals": 0})
-            referrals = user_data["referrals"]
-            points = user_data["points"]
-            msg_text = (
-                f"👥 رابط الدعوة الخاص بك:\n{referral_link}\n"
-                f"شارك الرابط لكسب 10 نقاط لكل صديق!\n"
-                f"إحالاتك: {referrals} | نقاطك: {points}"
-            )
-            msg = bot.send_message(chat_id, msg_text, reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "invite_friends")
-        elif call.data == "tasks":
-            markup = InlineKeyboardMarkup()
-            markup.add(
-                InlineKeyboardButton("📩 إرسال شكوى (10 نقاط)", callback_data="complaint"),
-                InlineKeyboardButton("👥 دعوة صديق (10 نقاط)", callback_data="invite_friends")
-            )
-            markup.row(
-                InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-            )
-            msg = bot.send_message(chat_id, "📋 المهام المتاحة:", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "tasks")
-        elif call.data == "settings":
-            markup = InlineKeyboardMarkup()
-            markup.add(InlineKeyboardButton("⚙️ لسه تحت التطوير", callback_data="under_dev"))
-            markup.row(
-                InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-            )
-            msg = bot.send_message(chat_id, "⚙️ الإعدادات:", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "settings")
-        elif call.data == "about":
-            msg = bot.send_message(chat_id, "ℹ️ بوت لإدارة الأيردروبات!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "about")
-        elif call.data == "complaint":
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_action"))
-            msg = bot.send_message(chat_id, "📩 أرسل شكواك:", reply_markup=markup)
-            user_states[user_id] = "sending_complaint"
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "complaint")
-        elif call.data == "stats":
-            total_users = len(global_data["users"])
-            total_bots = sum(len(user_data.get("bots", [])) for user_data in global_data["users"].values())
-            total_verified = len(global_data["verified_bots"])
-            stats_text = (
-                f"📊 الإحصائيات:\n"
-                f"عدد المستخدمين: {total_users}\n"
-                f"عدد البوتات المضافة: {total_bots}\n"
-                f"عدد البوتات المعتمدة: {total_verified}"
-            )
-            msg = bot.send_message(chat_id, stats_text, reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-            add_to_page_history(user_id, "stats")
-        elif call.data == "admin_panel":
-            if user_id in ADMIN_IDS:
-                admin_panel(chat_id, user_id)
-            else:
-                msg = bot.send_message(chat_id, "🚫 متاح للأدمن فقط!", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "admin_library":
-            if user_id in ADMIN_IDS:
-                admin_library_menu(chat_id, user_id)
-        elif call.data == "admin_view_bots":
-            if user_id in ADMIN_IDS:
-                admin_view_bots(chat_id, user_id)
-        elif call.data.startswith("verify_bot_"):
-            if user_id in ADMIN_IDS:
-                uid, bot_index = map(int, call.data.split("_")[2:])
-                user_data = global_data["users"].get(str(uid), {"bots": []})
-                bot_to_verify = user_data["bots"].pop(bot_index)
-                global_data["verified_bots"].append(bot_to_verify)
-                global_data["users"][str(uid)] = user_data
-                save_data()
-                msg = bot.send_message(chat_id, "✅ تم اعتماد البوت!", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "admin_users":
-            if user_id in ADMIN_IDS:
-                markup = InlineKeyboardMarkup()
-                for uid in global_data["users"].keys():
-                    user_data = global_data["users"][uid]
-                    markup.add(InlineKeyboardButton(f"ID: {uid} - نقاط: {user_data['points']}", callback_data=f"view_user_{uid}"))
-                markup.row(
-                    InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-                    InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-                )
-                msg = bot.send_message(chat_id, "👤 إدارة المستخدمين:", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-                add_to_page_history(user_id, "admin_users")
-        elif call.data == "admin_clean":
-            if user_id in ADMIN_IDS:
-                last_messages.clear()
-                msg = bot.send_message(chat_id, "🗑️ تم تنظيف الرسائل!", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data.startswith("admin_"):
-            if user_id not in ADMIN_IDS:
-                msg = bot.send_message(chat_id, "🚫 متاح للأدمن فقط!", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-            else:
-                msg = bot.send_message(chat_id, "⚙️ تحت التطوير!", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-        else:
-            msg = bot.send_message(chat_id, "عذرًا، هذا الخيار غير متاح!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-    except Exception as e:
-        logging.error(f"خطأ في معالجة الضغط لـ {user_id}: {e}")
-
-# معالجة الإدخال
-@bot.message_handler(func=lambda message: True)
-def handle_user_input(message):
-    try:
-        user_id = message.from_user.id
-        chat_id = message.chat.id
-        text = message.text
-        bot.delete_message(chat_id, message.message_id)
-        
-        if user_id in user_states:
-            delete_previous_messages(chat_id, user_id)
-            state = user_states[user_id]
-            
-            if state == "searching_bots":
-                user_states.pop(user_id)
-                show_search_results(chat_id, user_id, text)
-            elif state == "adding_bot_link":
-                user_inputs.setdefault(user_id, {})["link"] = text
-                user_states[user_id] = "adding_bot_description"
-                markup = InlineKeyboardMarkup()
-                markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-                msg = bot.send_message(chat_id, "📝 أرسل وصف البوت:", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-            elif state == "adding_bot_description":
-                user_inputs[user_id]["description"] = text
-                user_states[user_id] = "adding_bot_name"
-                markup = InlineKeyboardMarkup()
-                markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot"))
-                msg = bot.send_message(chat_id, "📝 أرسل اسم البوت:", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-            elif state == "adding_bot_name":
-                user_inputs[user_id]["name"] = text
-                markup = InlineKeyboardMarkup()
-                markup.row(
-                    InlineKeyboardButton("✅ تأكيد", callback_data="confirm_bot_link"),
-                    InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_link"),
-                    InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-                )
-                msg = bot.send_message(chat_id, f"📝 لينك البوت:\n{user_inputs[user_id]['link']}", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-            elif state == "editing_bot_link":
-                user_inputs[user_id]["link"] = text
-                markup = InlineKeyboardMarkup()
-                markup.row(
-                    InlineKeyboardButton("✅ تأكيد", callback_data="confirm_bot_description"),
-                    InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_link"),
-                    InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-                )
-                msg = bot.send_message(chat_id, f"📝 لينك البوت المعدل:\n{text}", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-                user_states[user_id] = "editing_bot_description"
-            elif state == "editing_bot_description":
-                user_inputs[user_id]["description"] = text
-                markup = InlineKeyboardMarkup()
-                markup.row(
-                    InlineKeyboardButton("✅ تأكيد", callback_data="confirm_bot_name"),
-                    InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_description"),
-                    InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-                )
-                msg = bot.send_message(chat_id, f"📝 وصف البوت المعدل:\n{text}", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-                user_states[user_id] = "editing_bot_name"
-            elif state == "editing_bot_name":
-                user_inputs[user_id]["name"] = text
-                markup = InlineKeyboardMarkup()
-                markup.row(
-                    InlineKeyboardButton("✅ تأكيد", callback_data="confirm_add_bot"),
-                    InlineKeyboardButton("✏️ تعديل", callback_data="edit_bot_name"),
-                    InlineKeyboardButton("❌ إلغاء", callback_data="cancel_add_bot")
-                )
-                msg = bot.send_message(chat_id, f"📝 اسم البوت المعدل:\n{text}", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-            elif state == "sending_complaint":
-                user_inputs[user_id] = {"complaint": text}
-                markup = InlineKeyboardMarkup()
-                markup.row(
-                    InlineKeyboardButton("✅ تأكيد", callback_data="confirm_complaint"),
-                    InlineKeyboardButton("✏️ تعديل", callback_data="edit_complaint"),
-                    InlineKeyboardButton("❌ إلغاء", callback_data="cancel_action")
-                )
-                msg = bot.send_message(chat_id, f"📩 شكواك:\n{text}", reply_markup=markup)
-                add_message_to_history(chat_id, user_id, msg.message_id)
-    except Exception as e:
-        logging.error(f"خطأ في معالجة الإدخال لـ {user_id}: {e}")
-
-@bot.callback_query_handler(func=lambda call: call.data in ["confirm_complaint", "edit_complaint"])
-def handle_complaint_confirmation(call):
-    try:
-        chat_id = call.message.chat.id
-        user_id = call.from_user.id
-        delete_previous_messages(chat_id, user_id)
-        
-        markup = InlineKeyboardMarkup()
-        markup.row(
-            InlineKeyboardButton("🏠 رجوع للقايمة الرئيسية", callback_data="main_menu"),
-            InlineKeyboardButton("⬅️ رجوع للسابقة", callback_data="go_back")
-        )
-        
-        if call.data == "confirm_complaint":
-            user_data = global_data["users"].get(str(user_id), {"points": 0, "referrals": 0})
-            user_data["points"] += 10
-            global_data["users"][str(user_id)] = user_data
-            save_data()
-            user_states.pop(user_id, None)
-            user_inputs.pop(user_id, None)
-            msg = bot.send_message(chat_id, "✅ تم تسجيل شكواك وحصلت على 10 نقاط!", reply_markup=markup)
-            add_message_to_history(chat_id, user_id, msg.message_id)
-        elif call.data == "edit_complaint":
-            markup = InlineKeyboardMarkup()
-            markup.row(InlineKeyboardButton("❌ إلغاء", callback_data="cancel_action"))
-            msg = bot.send_message(chat_id, "📩 أرسل شكواك مرة أخرى:", reply_markup=markup)
-            user_states[user_id] = "sending_complaint"
-            add_message_to_history(chat_id, user_id, msg.message_id)
-    except Exception as e:
-        logging.error(f"خطأ في معالجة الشكوى لـ {user_id}: {e}")
-
-# تشغيل البوت
-def run_bot():
-    while True:
-        try:
-            print("البوت شغال...")
-            logging.info("بدء تشغيل البوت...")
-            bot.polling(non_stop=True, interval=1, timeout=20)
-        except (ConnectionError, ReadTimeout) as e:
-            logging.error(f"خطأ في الاتصال: {e}")
-            time.sleep(5)
-        except Exception as e:
-            logging.error(f"خطأ غير متوقع: {e}")
-            time.sleep(5)
-
-if __name__ == "__main__":
-    run_bot()
\ No newline at end of file
+import logging
+import logging.handlers
+import telebot
+import requests
+import json
+import os
+import sqlite3
+import time
+import threading
+import atexit
+import queue
+import gc
+import heapq
+import itertools
+import hmac
+import secrets
+import re
+import sys
+import signal
+import multiprocessing
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+from requests.exceptions import ConnectionError, ReadTimeout
+
+# إعدادات التسجيل: الهاندلرز يحطوا السجلات في طابور بس، وخيط منفصل يكتبها للملف
+LOG_FILE = os.getenv("LOG_FILE", "log.txt")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json أو text
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # اختياري: تدوير حسب الوقت (مثلًا midnight) بدل الحجم
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", 20))  # أقصى عدد سجلات من نفس السطر في كل نافذة
+LOG_SAMPLE_WINDOW = 60
+SLOW_UPDATE_SECONDS = 2
+
+# سياق التحديث الحالي في كل خيط عامل، يتضاف لكل سجل
+log_context = threading.local()
+
+class LogContextFilter(logging.Filter):
+    def filter(self, record):
+        record.user_id = getattr(log_context, "user_id", None)
+        record.update = getattr(log_context, "update", None)
+        record.route = getattr(log_context, "route", None)
+        started = getattr(log_context, "started", None)
+        record.duration_ms = round((record.created - started) * 1000, 1) if started else None
+        return True
+
+class LogSampler(logging.Filter):
+    # نفس سطر التسجيل يمر أول burst مرة في كل نافذة، والباقي يتعد بس
+    # وعدد المحذوف يطلع مع أول سجل من نفس السطر في النافذة اللي بعدها
+    def __init__(self, burst, window):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.lock = threading.Lock()
+        self.sites = {}  # (ملف، سطر) -> [بداية النافذة، العدد، المحذوف]
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or record.created - site[0] >= self.window:
+                if site is not None and site[2]:
+                    record.suppressed = site[2]
+                site = self.sites[key] = [record.created, 0, 0]
+            site[1] += 1
+            if site[1] > self.burst:
+                site[2] += 1
+                return False
+        return True
+
+class JsonFormatter(logging.Formatter):
+    FIELDS = ("user_id", "update", "route", "duration_ms", "suppressed")
+
+    def format(self, record):
+        entry = {"time": self.formatTime(record), "level": record.levelname, "message": record.getMessage()}
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging():
+    if LOG_ROTATE_WHEN:
+        file_handler = logging.handlers.TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8")
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+    if LOG_FORMAT == "json":
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(LogSampler(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW))
+    queue_handler.addFilter(LogContextFilter())
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    listener.start()
+    # أول atexit يتسجل هو آخر واحد يتنفذ، فسجلات الإيقاف توصل للملف
+    atexit.register(listener.stop)
+
+setup_logging()
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))  # 0 يعطل endpoint القياسات
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", 0))  # ملخص دوري في السجل كل كم ثانية (0 = معطل)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        # تقدير بحد الخانة اللي يقع فيها الترتيب المطلوب
+        running = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            running += count
+            if running >= q * self.count:
+                return bound
+        return 0.0
+
+# قياسات كل مسار (route) وكل دالة Bot API: توزيع زمن الاستجابة، عدد الطلبات والأخطاء،
+# وعدد الرسائل المحذوفة لكل ضغطة
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.update_latency = {}  # (نوع التحديث، المسار) -> من وصول التحديث لنهاية الهاندلر
+        self.handler_time = {}  # (نوع التحديث، المسار) -> زمن الهاندلر بس
+        self.deletes = {}  # المسار -> عدد الرسائل اللي انطلب حذفها في التحديث
+        self.api_latency = {}  # دالة الـ API -> زمن الطلب
+        self.api_errors = {}  # (دالة الـ API، الكود) -> العدد
+
+    @staticmethod
+    def histogram(table, key, bounds):
+        hist = table.get(key)
+        if hist is None:
+            hist = table[key] = Histogram(bounds)
+        return hist
+
+    def observe_update(self, update, route, latency, handler_seconds, deletes):
+        key = (update or "unknown", route or "none")
+        with self.lock:
+            self.histogram(self.update_latency, key, LATENCY_BUCKETS).observe(latency)
+            self.histogram(self.handler_time, key, LATENCY_BUCKETS).observe(handler_seconds)
+            self.histogram(self.deletes, key[1], COUNT_BUCKETS).observe(deletes)
+
+    def observe_api(self, method, seconds, error=None):
+        with self.lock:
+            self.histogram(self.api_latency, method, LATENCY_BUCKETS).observe(seconds)
+            if error is not None:
+                self.api_errors[(method, error)] = self.api_errors.get((method, error), 0) + 1
+
+    @staticmethod
+    def labels(names, values):
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+        return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+    def render_histogram(self, lines, name, help_text, table, names):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, hist in sorted(table.items()):
+            label = self.labels(names, key if isinstance(key, tuple) else (key,))
+            running = 0
+            for bound, count in zip(hist.bounds, hist.counts):
+                running += count
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {running}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {hist.count}')
+            lines.append(f"{name}_sum{{{label}}} {hist.total}")
+            lines.append(f"{name}_count{{{label}}} {hist.count}")
+
+    def render(self):
+        # صيغة Prometheus النصية
+        lines = []
+        with self.lock:
+            self.render_histogram(lines, "bot_update_latency_seconds", "Update arrival to handler completion", self.update_latency, ("update", "route"))
+            self.render_histogram(lines, "bot_handler_seconds", "Time spent inside the handler", self.handler_time, ("update", "route"))
+            self.render_histogram(lines, "bot_deletes_per_update", "Messages queued for deletion per update", self.deletes, ("route",))
+            self.render_histogram(lines, "bot_api_request_seconds", "Bot API request latency", self.api_latency, ("method",))
+            lines.append("# HELP bot_api_errors_total Failed Bot API requests")
+            lines.append("# TYPE bot_api_errors_total counter")
+            for key, count in sorted(self.api_errors.items()):
+                lines.append(f"bot_api_errors_total{{{self.labels(('method', 'code'), key)}}} {count}")
+        for key, value in outbound.stats().items():
+            lines.append(f"# TYPE bot_outbound_{key} gauge")
+            lines.append(f"bot_outbound_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        with self.lock:
+            slowest = sorted(self.update_latency.items(), key=lambda item: -item[1].quantile(0.99))[:5]
+            routes = ", ".join(f"{route}: n={hist.count} p50={hist.quantile(0.5)}s p99={hist.quantile(0.99)}s"
+                               for (_, route), hist in slowest)
+            api = ", ".join(f"{method}: {hist.count}" for method, hist in sorted(self.api_latency.items()))
+            errors = ", ".join(f"{method}/{code}: {count}" for (method, code), count in sorted(self.api_errors.items()))
+        return f"أبطأ المسارات: [{routes}] | طلبات API: [{api}] | أخطاء API: [{errors}] | الإرسال: {outbound.stats()}"
+
+    def summary_loop(self):
+        while True:
+            time.sleep(METRICS_LOG_INTERVAL)
+            try:
+                logging.info(f"ملخص القياسات: {self.summary()}")
+            except Exception as e:
+                logging.error(f"خطأ في ملخص القياسات: {e}")
+
+    def app(self, environ, start_response):
+        if environ.get("PATH_INFO") != "/metrics":
+            start_response("404 Not Found", [("Content-Type", "text/plain")])
+            return [b""]
+        body = self.render().encode("utf-8")
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def serve(self):
+        try:
+            server = make_server(METRICS_HOST, METRICS_PORT, self.app, ThreadingWSGIServer, QuietWSGIRequestHandler)
+        except OSError as e:
+            logging.error(f"فشل تشغيل endpoint القياسات على {METRICS_HOST}:{METRICS_PORT}: {e}")
+            return
+        logging.info(f"القياسات على http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        server.serve_forever()
+
+    def start(self):
+        if METRICS_PORT:
+            threading.Thread(target=self.serve, name="Metrics", daemon=True).start()
+        if METRICS_LOG_INTERVAL > 0:
+            threading.Thread(target=self.summary_loop, name="MetricsSummary", daemon=True).start()
+
+metrics = Metrics()
+
+# التحقق من التوكن
+try:
+    TOKEN = os.getenv("BOT_TOKEN")
+    if not TOKEN:
+        print("❌ خطأ: لم يتم العثور على التوكن!")
+        logging.error("لم يتم العثور على التوكن!")
+        exit()
+except Exception as e:
+    logging.error(f"خطأ في جلب التوكن: {e}")
+    print(f"خطأ في جلب التوكن: {e}")
+    exit()
+
+BOT_API_URL = os.getenv("BOT_API_URL")  # اختياري: سيرفر Bot API محلي، بصيغة http://host:port/bot{0}/{1}
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", 8))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 1000))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 8))  # أقصى انتظار للتحديثات بالطوابير عند الإيقاف (docker stop يمهل 10 ثواني)
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", 0))  # عدد عمليات العمال (0 = عملية وحدة)
+CLUSTER_WORKER = os.getenv("CLUSTER_WORKER")  # رقم العامل، يضبطه القائد للعمليات الفرعية فقط
+CLUSTER_SYNC_INTERVAL = float(os.getenv("CLUSTER_SYNC_INTERVAL", 1))  # كل كم ثانية يلتقط العامل تعديلات البوتات من غيره
+CLUSTER_STATS_INTERVAL = 30  # وكل كم ثانية يعيد حساب مجاميع الإحصائيات من القاعدة
+
+UPDATE_STATE_FILE = os.getenv("UPDATE_STATE_FILE", "updates.json")  # آخر offset ومعرفات التحديثات المنفذة
+DEDUPE_WINDOW = int(os.getenv("DEDUPE_WINDOW", 10000))  # عدد معرفات التحديثات والضغطات الأخيرة المحفوظة
+
+write_locks = {}  # مسار -> قفل: الحفظ الدوري وatexit ممكن يكتبوا نفس الملف المؤقت بنفس الوقت
+
+def write_json_atomic(path, data):
+    # ملف مؤقت ثم os.replace فالقارئ يشوف النسخة القديمة أو الجديدة كاملة. fsync قبل إعادة التسمية،
+    # وإلا بعد انقطاع الكهرباء ممكن الاسم يأشر على ملف فاضي فيضيع الحفظ السابق كمان
+    tmp_file = path + ".tmp"
+    with write_locks.setdefault(path, threading.Lock()):
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+# بعد إعادة التشغيل تيليجرام يعيد إرسال التحديثات اللي ما أكدناها، فنحفظ الـ offset ونافذة محدودة
+# (حلقة + set) بآخر المعرفات المنفذة عشان ما تنحسب النقاط مرتين. getUpdates يطلب من أقدم تحديث لسه
+# بالطوابير (offset())، فتيليجرام ما يعتبره مستلم، ولو توقف البوت قبل تنفيذه يرجع يوصل وينفذ.
+# في وضع webhook الرد 200 يأكد التحديث عند الاستلام، فاللي بالطابور وقت التوقف ما يرجع
+class UpdateLog:
+    def __init__(self, path, window):
+        self.path = path
+        self.lock = threading.Lock()
+        self.recent = deque(maxlen=window)
+        self.recent_set = set()
+        self.in_flight = {}  # معرف التحديث -> معرف الضغطة (أو None)
+        self.last_update_id = 0
+        self.dirty = False
+        self.progress = threading.Condition(self.lock)
+        self.acks = None  # في عامل العنقود: طابور يبلغ القائد إن التحديث خلص
+
+    def seen(self, key):
+        # المفاتيح: معرف التحديث (رقم) أو معرف الضغطة (نص)
+        with self.lock:
+            if key in self.recent_set:
+                return True
+            if len(self.recent) == self.recent.maxlen:
+                self.recent_set.discard(self.recent[0])
+            self.recent.append(key)
+            self.recent_set.add(key)
+            if isinstance(key, int):
+                self.last_update_id = max(self.last_update_id, key)
+            self.dirty = True
+            return False
+
+    def begin(self, update_id, callback_id=None):
+        with self.lock:
+            self.in_flight[update_id] = callback_id
+
+    def finish(self, update_id):
+        with self.lock:
+            self.in_flight.pop(update_id, None)
+            self.dirty = True
+            self.progress.notify_all()
+        self.confirm(update_id)
+
+    def confirm(self, update_id):
+        if self.acks is not None:
+            self.acks.put(update_id)
+
+    def pending(self, update_id):
+        with self.lock:
+            return update_id in self.in_flight
+
+    def first_unconfirmed(self):
+        # لازم يتنادى مع self.lock
+        return min(self.in_flight) if self.in_flight else self.last_update_id + 1
+
+    def offset(self):
+        with self.lock:
+            return self.first_unconfirmed()
+
+    def wait_for_progress(self, offset, timeout):
+        # ننتظر لين يخلص أقدم تحديث معلق (يتقدم الـ offset) أو ينتهي الوقت
+        with self.progress:
+            self.progress.wait_for(lambda: self.first_unconfirmed() != offset, timeout)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for key in data.get("recent", []):
+            self.seen(key)
+        self.last_update_id = max(self.last_update_id, data.get("offset", 1) - 1)
+        self.dirty = False
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            pending = set(self.in_flight) | {key for key in self.in_flight.values() if key is not None}
+            data = {
+                "offset": self.first_unconfirmed(),
+                "recent": [key for key in self.recent if key not in pending],
+            }
+            self.dirty = False
+        write_json_atomic(self.path, data)
+
+    def save_loop(self):
+        while True:
+            time.sleep(DURABILITY_WINDOW)
+            try:
+                self.save()
+            except Exception as e:
+                logging.error(f"خطأ في حفظ حالة التحديثات: {e}")
+
+    def start(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.error(f"خطأ في تحميل حالة التحديثات: {e}")
+        threading.Thread(target=self.save_loop, name="UpdateLogSaver", daemon=True).start()
+        atexit.register(self.save)
+
+update_log = UpdateLog(UPDATE_STATE_FILE, DEDUPE_WINDOW)
+
+def join_queue(tasks, timeout=None):
+    # مثل Queue.join بس بمهلة؛ يرجع False لو انتهت قبل ما يخلص كل اللي بالطابور
+    deadline = None if timeout is None else time.time() + timeout
+    with tasks.all_tasks_done:
+        while tasks.unfinished_tasks:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            tasks.all_tasks_done.wait(remaining)
+    return True
+
+# توزيع التحديثات على عدة خيوط: كل مستخدم له خيط ثابت (user_id % عدد الخيوط)
+# فتحديثات نفس المستخدم تتنفذ بالترتيب، والمستخدمين المختلفين يشتغلوا بالتوازي
+class ShardedTeleBot(telebot.TeleBot):
+    def __init__(self, token, num_workers=WORKER_THREADS, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        self.shards = [queue.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(num_workers)]
+        self.ingest = threading.local()
+        for i, shard in enumerate(self.shards):
+            threading.Thread(target=self.worker_loop, args=(shard,), name=f"UpdateWorker-{i}", daemon=True).start()
+
+    @staticmethod
+    def worker_loop(shard):
+        while True:
+            task, args, kwargs, enqueued, update_id = shard.get()
+            from_user = getattr(args[0], "from_user", None) if args else None
+            log_context.user_id = from_user.id if from_user else None
+            log_context.update = kwargs.get("update_type")
+            log_context.route = None
+            log_context.deletes = 0
+            log_context.started = time.time()
+            try:
+                if not storage.ready.is_set():
+                    wait_for_storage(args[0] if args else None)
+                task(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"خطأ في تنفيذ التحديث: {e}")
+            finally:
+                finished = time.time()
+                duration = finished - log_context.started
+                if duration > SLOW_UPDATE_SECONDS:
+                    logging.warning(f"تحديث بطيء: {duration:.2f} ثانية")
+                metrics.observe_update(log_context.update, log_context.route, finished - enqueued, duration, log_context.deletes)
+                log_context.started = None
+                if update_id is not None:
+                    update_log.finish(update_id)
+                shard.task_done()
+
+    def process_new_updates(self, updates):
+        # telebot يجمع الدفعة حسب النوع (كل الرسائل ثم كل الضغطات)، فنمررها وحدة وحدة لنحافظ على ترتيب الوصول
+        for update in updates:
+            callback_id = update.callback_query.id if update.callback_query else None
+            if update_log.seen(update.update_id) or (callback_id is not None and update_log.seen(callback_id)):
+                logging.info(f"تم تجاهل تحديث مكرر {update.update_id}")
+                # في العنقود القائد ينتظر تأكيد كل تحديث أرسله، حتى لو العامل نفذه قبل ما يطيح
+                update_log.confirm(update.update_id)
+                continue
+            update_log.begin(update.update_id, callback_id)
+            self.ingest.update_id = update.update_id
+            self.ingest.queued = False
+            try:
+                super().process_new_updates([update])
+            finally:
+                self.ingest.update_id = None
+                # تحديث ما له هاندلر ينتهي هنا، والباقي لما يخلص خيط العامل منه
+                if not self.ingest.queued:
+                    update_log.finish(update.update_id)
+
+    def get_updates(self, offset=None, limit=None, timeout=20, allowed_updates=None, long_polling_timeout=20):
+        # بدل last_update_id + 1 نطلب من أقدم تحديث ما خلص، فاللي بالطوابير ما يتأكد عند تيليجرام
+        offset = update_log.offset()
+        updates = super().get_updates(offset, limit, timeout, allowed_updates, long_polling_timeout)
+        if updates and all(update_log.pending(update.update_id) for update in updates):
+            # تيليجرام يرجع المعلقين فورًا بدون long polling، فننتظر يخلص أقدمها بدل ما نعيد الطلب بحلقة.
+            # لو المعلقين أكثر من دفعة getUpdates كاملة ما يوصل جديد لين يخلص الأقدم (ضغط عكسي على الاستلام)
+            update_log.wait_for_progress(offset, 1)
+        return updates
+
+    def _exec_task(self, task, *args, **kwargs):
+        from_user = getattr(args[0], "from_user", None) if args else None
+        shard_key = from_user.id if from_user else 0
+        update_id = getattr(self.ingest, "update_id", None)
+        self.ingest.queued = True
+        self.shards[shard_key % len(self.shards)].put((task, args, kwargs, time.time(), update_id))
+
+    def join_workers(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for shard in self.shards:
+            if not join_queue(shard, None if deadline is None else max(0, deadline - time.time())):
+                return False
+        return True
+
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", 30))  # حد تيليجرام العام تقريبًا 30 رسالة بالثانية
+CHAT_RATE = float(os.getenv("CHAT_RATE", 1))  # ورسالة بالثانية لكل شات
+CHAT_BURST = int(os.getenv("CHAT_BURST", 3))
+MAX_FLOOD_RETRIES = 3
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTIFICATION = 1
+NOTIFICATION_MAX_DEFER = float(os.getenv("NOTIFICATION_MAX_DEFER", 2))  # أقصى مدة (ثواني) يتأخر فيها الإشعار للردود التفاعلية
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+# كل طلبات Bot API تمر من هنا (عبر CUSTOM_REQUEST_SENDER): token bucket عام وواحد لكل شات،
+# احترام retry_after عند 429 بدل ضياع الرسالة، والردود التفاعلية قبل الإشعارات
+class OutboundScheduler:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.chat_buckets = OrderedDict()
+        self.blocked_until = {}  # الشات -> متى ينتهي انتظار الـ 429 (تنحذف بعد انتهائها)
+        self.waiting = [0, 0]
+        self.local = threading.local()
+        self.requests_total = 0
+        self.flood_waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def start(self):
+        apihelper.CUSTOM_REQUEST_SENDER = self.request
+
+    @contextmanager
+    def priority(self, priority):
+        previous = getattr(self.local, "priority", PRIORITY_INTERACTIVE)
+        self.local.priority = priority
+        try:
+            yield
+        finally:
+            self.local.priority = previous
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.pop(chat_id, None) or TokenBucket(CHAT_RATE, CHAT_BURST)
+        self.chat_buckets[chat_id] = bucket
+        if len(self.chat_buckets) > 10000:
+            self.chat_buckets.popitem(last=False)
+        return bucket
+
+    def acquire(self, chat_id, priority):
+        started = time.monotonic()
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    bucket = self.chat_bucket(chat_id) if chat_id is not None else None
+                    wait = self.blocked_until.get(chat_id, 0) - now
+                    deferred = now - started
+                    if wait <= 0 and priority == PRIORITY_NOTIFICATION and self.waiting[PRIORITY_INTERACTIVE] \
+                            and deferred < NOTIFICATION_MAX_DEFER:
+                        # نفسح للردود التفاعلية، لكن لمدة محدودة: إشعار الإحالة يتبعث من خيط عامل المستخدم،
+                        # فالانتظار المفتوح تحت ضغط مستمر يوقف كل المستخدمين على نفس الخيط
+                        wait = NOTIFICATION_MAX_DEFER - deferred
+                    elif wait <= 0:
+                        wait = max(self.global_bucket.delay(now), bucket.delay(now) if bucket else 0)
+                        if wait <= 0:
+                            self.global_bucket.take()
+                            if bucket:
+                                bucket.take()
+                            waited = now - started
+                            self.requests_total += 1
+                            self.wait_time_total += waited
+                            self.wait_time_max = max(self.wait_time_max, waited)
+                            break
+                    self.cond.wait(wait)
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+
+    def send(self, method, url, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.time()
+        try:
+            result = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception as e:
+            metrics.observe_api(api_method, time.time() - started, type(e).__name__)
+            raise
+        metrics.observe_api(api_method, time.time() - started, str(result.status_code) if result.status_code >= 400 else None)
+        return result
+
+    def request(self, method, url, params=None, files=None, **kwargs):
+        if url.rsplit("/", 1)[-1] == "getUpdates":
+            return self.send(method, url, params=params, files=files, **kwargs)
+        chat_id = str(params["chat_id"]) if params and "chat_id" in params else None
+        priority = getattr(self.local, "priority", PRIORITY_INTERACTIVE)
+        for attempt in range(MAX_FLOOD_RETRIES + 1):
+            self.acquire(chat_id, priority)
+            result = self.send(method, url, params=params, files=files, **kwargs)
+            if result.status_code != 429 or attempt == MAX_FLOOD_RETRIES:
+                return result
+            try:
+                retry_after = result.json().get("parameters", {}).get("retry_after", 1)
+            except ValueError:
+                retry_after = 1
+            self.flood_waits += 1
+            logging.warning(f"429 من تيليجرام للشات {chat_id}: انتظار {retry_after} ثانية")
+            if chat_id is None:
+                # طلب بدون شات (مثل answerCallbackQuery): الانتظار يخص هذا الطلب بس، مو كل الشاتات
+                time.sleep(retry_after)
+                continue
+            with self.cond:
+                now = time.monotonic()
+                for blocked_chat in [key for key, until in self.blocked_until.items() if until <= now]:
+                    del self.blocked_until[blocked_chat]
+                self.blocked_until[chat_id] = now + retry_after
+                self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                "queue_interactive": self.waiting[PRIORITY_INTERACTIVE],
+                "queue_notification": self.waiting[PRIORITY_NOTIFICATION],
+                "requests_total": self.requests_total,
+                "flood_waits": self.flood_waits,
+                "wait_time_avg": self.wait_time_total / self.requests_total if self.requests_total else 0.0,
+                "wait_time_max": self.wait_time_max,
+            }
+
+API_CACHE_SIZE = 10000
+BOT_INFO_TTL = int(os.getenv("BOT_INFO_TTL", 24 * 3600))
+CHAT_INFO_TTL = int(os.getenv("CHAT_INFO_TTL", 600))
+MEMBER_STATUS_TTL = int(os.getenv("MEMBER_STATUS_TTL", 300))
+
+# كاش لبيانات الـ API اللي نادرًا ما تتغير (هوية البوت، معلومات الشات، حالة العضوية)
+# بدل طلب كامل لتيليجرام مع كل ضغطة
+class ApiCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # المفتاح -> (وقت الانتهاء، القيمة)
+
+    def cached(self, key, ttl, fetch):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                return entry[1]
+        try:
+            value = fetch()
+        except Exception as e:
+            if entry is None:
+                raise
+            # تيليجرام ما رد: النسخة القديمة أحسن من إفشال الهاندلر
+            logging.warning(f"فشل تحديث {key[0]}، نستخدم النسخة المخزنة: {e}")
+            return entry[1]
+        with self.lock:
+            self.entries[key] = (now + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def me(self):
+        return self.cached(("getMe",), BOT_INFO_TTL, bot.get_me)
+
+    def chat(self, chat_id):
+        return self.cached(("getChat", chat_id), CHAT_INFO_TTL, lambda: bot.get_chat(chat_id))
+
+    def member_status(self, chat_id, user_id):
+        return self.cached(("getChatMember", chat_id, user_id), MEMBER_STATUS_TTL,
+                           lambda: bot.get_chat_member(chat_id, user_id).status)
+
+    def start(self):
+        try:
+            me = self.me()
+            logging.info(f"هوية البوت: @{me.username}")
+        except Exception as e:
+            logging.error(f"فشل في جلب هوية البوت: {e}")
+
+# إنشاء البوت
+try:
+    if BOT_API_URL:
+        apihelper.API_URL = BOT_API_URL
+    bot = ShardedTeleBot(TOKEN)
+    outbound = OutboundScheduler()
+    api_cache = ApiCache(API_CACHE_SIZE)
+    logging.info("البوت بدأ يشتغل")
+except Exception as e:
+    logging.error(f"خطأ في إنشاء البوت: {e}")
+    print(f"خطأ في إنشاء البوت: {e}")
+    exit()
+
+# المتغيرات العامة
+SESSION_MAX_USERS = int(os.getenv("SESSION_MAX_USERS", 50000))
+SESSION_TTL = int(os.getenv("SESSION_TTL", 24 * 3600))  # الجلسات المهجورة (ومسوداتها) تنحذف بعد هذه المدة
+SESSION_FILE = os.getenv("SESSION_FILE")  # اختياري: حفظ الجلسات لتبقى بعد إعادة التشغيل
+SESSION_SAVE_INTERVAL = float(os.getenv("SESSION_SAVE_INTERVAL", 5))  # مع SESSION_FILE: كل كم ثانية تنحفظ (لو توقف مفاجئ ما يمر على atexit)
+PAGE_HISTORY_LIMIT = 20
+MESSAGE_HISTORY_LIMIT = 10
+
+# جلسة واحدة لكل مستخدم بدل خمس قواميس منفصلة
+class Session:
+    __slots__ = ("state", "inputs", "page", "page_history", "messages", "touched")
+
+    def __init__(self):
+        self.state = None
+        self.inputs = {}
+        self.page = 1
+        self.page_history = deque(maxlen=PAGE_HISTORY_LIMIT)
+        self.messages = deque(maxlen=MESSAGE_HISTORY_LIMIT)
+        self.touched = time.time()
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "inputs": dict(self.inputs),
+            "page": self.page,
+            "page_history": list(self.page_history),
+            "messages": list(self.messages),
+            "touched": self.touched,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        session = cls()
+        session.state = data.get("state")
+        session.inputs = data.get("inputs") or {}
+        session.page = data.get("page", 1)
+        session.page_history.extend(data.get("page_history", []))
+        session.messages.extend(data.get("messages", []))
+        session.touched = data.get("touched", session.touched)
+        return session
+
+# مخزن الجلسات: LRU بحد أقصى للعدد + انتهاء صلاحية (TTL).
+# كل مستخدم يتعامل معه خيط واحد فقط، فمحتوى الجلسة ما يتعدل من خيطين بنفس الوقت؛ القفل يحمي القاموس نفسه
+class SessionStore:
+    def __init__(self, max_size, ttl, spill_file=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.spill_file = spill_file
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        self.changed = False
+
+    def get(self, user_id):
+        now = time.time()
+        with self.lock:
+            # الهاندلر ياخذ الجلسة عشان يعدلها، فأي وصول يكفي للحفظ الدوري
+            self.changed = True
+            session = self.sessions.pop(user_id, None)
+            if session is None or now - session.touched > self.ttl:
+                session = Session()
+            session.touched = now
+            self.sessions[user_id] = session
+            while len(self.sessions) > self.max_size:
+                self.sessions.popitem(last=False)
+            return session
+
+    def sweep(self):
+        # الترتيب حسب آخر استخدام، فنوقف عند أول جلسة لسه صالحة
+        expire_before = time.time() - self.ttl
+        with self.lock:
+            while self.sessions:
+                user_id, session = next(iter(self.sessions.items()))
+                if session.touched > expire_before:
+                    break
+                self.sessions.popitem(last=False)
+
+    def clear_messages(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.messages.clear()
+
+    def load(self):
+        if not self.spill_file or not os.path.exists(self.spill_file):
+            return
+        with open(self.spill_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for user_id, session_data in sorted(data.items(), key=lambda item: item[1].get("touched", 0)):
+            self.sessions[int(user_id)] = Session.from_dict(session_data)
+        self.sweep()
+
+    def save(self):
+        if not self.spill_file:
+            return
+        with self.lock:
+            self.changed = False
+            data = {str(user_id): session.to_dict() for user_id, session in self.sessions.items()}
+        write_json_atomic(self.spill_file, data)
+
+    def sweep_loop(self):
+        while True:
+            time.sleep(60)
+            self.sweep()
+
+    def save_loop(self):
+        # الحفظ عند الإيقاف ما يصير لو العملية انقتلت (kill -9 أو عامل عنقود طاح)، فنحفظ دوريًا كمان.
+        # الهاندلر يعدل الجلسة بعد get، فبعد أي دورة فيها وصول نحفظ الدورة اللي بعدها كمان
+        recent = False
+        while True:
+            time.sleep(SESSION_SAVE_INTERVAL)
+            changed = self.changed
+            if not changed and not recent:
+                continue
+            recent = changed
+            try:
+                self.save()
+            except Exception as e:
+                self.changed = True
+                logging.error(f"خطأ في حفظ الجلسات: {e}")
+
+    def start(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.error(f"خطأ في تحميل الجلسات: {e}")
+        threading.Thread(target=self.sweep_loop, name="SessionSweeper", daemon=True).start()
+        if self.spill_file:
+            threading.Thread(target=self.save_loop, name="SessionSaver", daemon=True).start()
+        atexit.register(self.save)
+
+sessions = SessionStore(SESSION_MAX_USERS, SESSION_TTL, SESSION_FILE)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")  # json أو sqlite
+DATA_FILE = "users.jsonl"  # لقطة بسطر لكل سجل (نفس صيغة الـ journal) فتنقرأ سطر سطر
+LEGACY_DATA_FILE = "users.json"  # الصيغة القديمة: ملف JSON واحد ينقرأ كامل بالذاكرة
+JOURNAL_FILE = "users.journal"
+SQLITE_FILE = os.getenv("SQLITE_FILE", "users.db")
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", 1024 * 1024))
+COMPACT_INTERVAL = int(os.getenv("COMPACT_INTERVAL", 300))
+DURABILITY_WINDOW = float(os.getenv("DURABILITY_WINDOW", 1.0))  # أقصى مدة (ثواني) قبل ما يوصل التعديل للقرص
+FLUSH_BATCH = int(os.getenv("FLUSH_BATCH", 100))  # أو بعد هذا العدد من التعديلات، أيهما أسبق
+STATS_FILE = os.getenv("STATS_FILE", "stats.json")  # السلاسل الزمنية للإحصائيات (المجاميع تنبني من التخزين)
+STATS_DAYS = 30  # عدد الأيام المحفوظة لسلسلة المستخدمين الجدد
+STATS_HOURS = 48  # عدد الساعات المحفوظة لسلسلة البوتات المضافة
+REPLAY_BATCH = 1000  # عدد أسطر اللقطة/السجل اللي تنحلل مع بعض عند التحميل
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", 2))  # أقصى انتظار للتحديث قبل ما نرد "جاري التجهيز" أثناء التحميل
+
+SEARCH_PAGE_SIZE = 10
+ADMIN_PAGE_SIZE = 10
+LEADERBOARD_SIZE = 10
+RANK_CACHE_TTL = int(os.getenv("RANK_CACHE_TTL", 60))  # SQLite: كم ثانية يبقى ترتيب المستخدم محفوظ بعد حسابه
+RANK_CACHE_SIZE = 10000
+LAST_ID = 2 ** 63 - 1  # بداية الصفحة الأولى في الترتيب التنازلي
+VERIFIED_OWNER = 0  # مالك البوتات المعتمدة في فهرس البحث
+
+# توحيد النص العربي قبل الفهرسة والبحث: حذف التشكيل والتطويل وتوحيد الألف والهمزة والتاء المربوطة
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_FOLD = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و", "ئ": "ي", "ى": "ي", "ة": "ه"})
+WORD_RE = re.compile(r"\w+")
+
+def normalize_words(text):
+    return WORD_RE.findall(ARABIC_DIACRITICS.sub("", text.casefold()).translate(ARABIC_FOLD))
+
+# فهرس مقلوب لبوتات المستخدمين والبوتات المعتمدة: كلمة -> مالك -> {رقم المستند: الوزن}
+# التقسيم حسب المالك يخلي البحث يمر على بوتات المستخدم والمعتمدة بس، والكلمات محفوظة
+# مرتبة عشان البحث بالبادئة يكون bisect بدل المرور على كل الكلمات
+class SearchIndex:
+    NAME_WEIGHT = 2
+    DESCRIPTION_WEIGHT = 1
+    MIN_PREFIX = 2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.docs = {}  # رقم المستند -> (المالك، البوت، كلماته وأوزانها)
+        self.postings = {}
+        self.terms = []
+
+    def add(self, doc_id, owner, bot_item):
+        weights = {}
+        for word in normalize_words(bot_item["description"]):
+            weights[word] = self.DESCRIPTION_WEIGHT
+        for word in normalize_words(bot_item["name"]):
+            weights[word] = self.NAME_WEIGHT
+        with self.lock:
+            self.unlink(doc_id)
+            self.docs[doc_id] = (owner, bot_item, weights)
+            self.link(doc_id, owner, weights)
+
+    def link(self, doc_id, owner, weights):
+        for word, weight in weights.items():
+            by_owner = self.postings.get(word)
+            if by_owner is None:
+                by_owner = self.postings[word] = {}
+                insort(self.terms, word)
+            by_owner.setdefault(owner, {})[doc_id] = weight
+
+    def unlink(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return None
+        owner, _, weights = doc
+        for word in weights:
+            by_owner = self.postings[word]
+            del by_owner[owner][doc_id]
+            if not by_owner[owner]:
+                del by_owner[owner]
+            if not by_owner:
+                del self.postings[word]
+                del self.terms[bisect_left(self.terms, word)]
+        return doc
+
+    def remove(self, doc_id):
+        with self.lock:
+            self.unlink(doc_id)
+
+    def get(self, doc_id):
+        with self.lock:
+            doc = self.docs.get(doc_id)
+            return (doc[0], doc[1]) if doc is not None else None
+
+    def set_owner(self, doc_id, owner):
+        with self.lock:
+            doc = self.unlink(doc_id)
+            if doc is not None:
+                self.docs[doc_id] = (owner, doc[1], doc[2])
+                self.link(doc_id, owner, doc[2])
+
+    def match(self, word, owners):
+        # كل مستندات الملاك المطلوبين اللي فيها كلمة تبدأ بـ word؛ المطابقة التامة تاخذ ضعف الوزن
+        scores = {}
+        i = bisect_left(self.terms, word)
+        # الكلمات القصيرة جدًا تطابق نفسها بس، وإلا حرف واحد يرجع الفهرس كله
+        end = len(self.terms)
+        if len(word) < self.MIN_PREFIX:
+            end = i + 1 if i < end and self.terms[i] == word else i
+        while i < end and self.terms[i].startswith(word):
+            term = self.terms[i]
+            bonus = 2 if term == word else 1
+            by_owner = self.postings[term]
+            for owner in owners:
+                for doc_id, weight in by_owner.get(owner, {}).items():
+                    if weight * bonus > scores.get(doc_id, 0):
+                        scores[doc_id] = weight * bonus
+            i += 1
+        return scores
+
+    def search(self, query, owners, offset=0, limit=SEARCH_PAGE_SIZE):
+        words = list(dict.fromkeys(normalize_words(query)))
+        if not words:
+            return 0, []
+        with self.lock:
+            # كل كلمات البحث لازم تطابق
+            scores = self.match(words[0], owners)
+            for word in words[1:]:
+                if not scores:
+                    break
+                word_scores = self.match(word, owners)
+                scores = {doc_id: score + word_scores[doc_id] for doc_id, score in scores.items() if doc_id in word_scores}
+            top = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))[offset:]
+            return len(scores), [(doc_id, self.docs[doc_id][0], self.docs[doc_id][1]) for doc_id, _ in top]
+
+# عدادات الإحصائيات: تتحدث مع كل تعديل في التخزين بدل ما نعد كل المستخدمين مع كل ضغطة
+class StatsCounters:
+    def __init__(self, stats_file=None):
+        self.stats_file = stats_file
+        self.lock = threading.Lock()
+        self.users = 0
+        self.bots = 0
+        self.verified = 0
+        self.referrals = 0
+        self.points = 0
+        self.new_users = OrderedDict()  # رقم اليوم -> عدد المستخدمين الجدد
+        self.bots_added = OrderedDict()  # رقم الساعة -> عدد البوتات المضافة
+
+    def reset(self, users, bots, verified, referrals, points):
+        with self.lock:
+            self.users = users
+            self.bots = bots
+            self.verified = verified
+            self.referrals = referrals
+            self.points = points
+
+    @staticmethod
+    def bump(series, bucket, keep):
+        series[bucket] = series.get(bucket, 0) + 1
+        while next(iter(series)) <= bucket - keep:
+            series.popitem(last=False)
+
+    def user_added(self):
+        with self.lock:
+            self.users += 1
+            self.bump(self.new_users, int(time.time() // 86400), STATS_DAYS)
+
+    def points_added(self, points, referrals=0):
+        with self.lock:
+            self.points += points
+            self.referrals += referrals
+
+    def bot_added(self):
+        with self.lock:
+            self.bots += 1
+            self.bump(self.bots_added, int(time.time() // 3600), STATS_HOURS)
+
+    def bot_deleted(self):
+        with self.lock:
+            self.bots -= 1
+
+    def bot_verified(self):
+        with self.lock:
+            self.bots -= 1
+            self.verified += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "users": self.users,
+                "bots": self.bots,
+                "verified": self.verified,
+                "referrals": self.referrals,
+                "points": self.points,
+            }
+
+    def series(self, series, count, step):
+        # آخر count فترة بالترتيب، مع أصفار للفترات الفاضية
+        with self.lock:
+            last = int(time.time() // step)
+            return [(bucket * step, series.get(bucket, 0)) for bucket in range(last - count + 1, last + 1)]
+
+    def daily_new_users(self, days):
+        return self.series(self.new_users, days, 86400)
+
+    def hourly_bots_added(self, hours):
+        return self.series(self.bots_added, hours, 3600)
+
+    def load(self):
+        if not self.stats_file or not os.path.exists(self.stats_file):
+            return
+        with open(self.stats_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with self.lock:
+            self.new_users = OrderedDict((int(bucket), count) for bucket, count in data.get("new_users", []))
+            self.bots_added = OrderedDict((int(bucket), count) for bucket, count in data.get("bots_added", []))
+
+    def save(self):
+        if not self.stats_file:
+            return
+        with self.lock:
+            data = {"new_users": list(self.new_users.items()), "bots_added": list(self.bots_added.items())}
+        write_json_atomic(self.stats_file, data)
+
+# طبقة التخزين: كل الهاندلرز تتعامل مع storage بدل الوصول المباشر للبيانات
+# الحفظ يتم في الخلفية (write-behind): الهاندلر يعدّل الذاكرة ويعلّم إن فيه تغيير،
+# وخيط منفصل يكتب كل التعديلات المتراكمة دفعة وحدة (group commit).
+# الواجهة مجردة (ABC): التخزين اللي ناقصه دالة يفشل عند الإنشاء بدل أول استخدام
+class Storage(ABC):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.flush_event = threading.Event()
+        self.pending = 0
+        self.search_index = SearchIndex()
+        self.stats = StatsCounters(STATS_FILE)
+        # يتفعل بعد تحميل البيانات وبناء الفهارس؛ خيوط العمال تنتظره قبل أي تحديث
+        self.ready = threading.Event()
+
+    def start(self):
+        # التحميل يصير بالخلفية عشان البوت يبدأ يستقبل التحديثات فورًا مهما كان حجم البيانات
+        atexit.register(self.close)
+        threading.Thread(target=self.warm_up, name="StorageWarmUp", daemon=True).start()
+
+    def load(self):
+        pass
+
+    def warm_up(self):
+        started = time.time()
+        # جامع الدورات يمر على كل الكائنات المحملة مرات كثيرة أثناء التحميل بدون فايدة، فنوقفه مؤقتًا
+        # ونجمد البيانات المحملة بعدها عشان ما تتفحص مع كل دورة جمع لاحقة
+        gc.disable()
+        try:
+            self.load()
+            self.build_search_index()
+            self.rebuild_stats()
+        except Exception as e:
+            logging.error(f"خطأ في إنشاء أو تحميل ملف البيانات: {e}")
+            print(f"خطأ في إنشاء أو تحميل ملف البيانات: {e}")
+            os._exit(1)
+        finally:
+            gc.freeze()
+            gc.enable()
+        try:
+            self.stats.load()
+        except Exception as e:
+            logging.error(f"خطأ في تحميل الإحصائيات: {e}")
+        logging.info(f"تم تحميل البيانات وبناء فهرس البحث ({len(self.search_index.docs)} بوت) في {time.time() - started:.2f} ثانية")
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+        self.ready.set()
+
+    def mark_dirty(self):
+        self.pending += 1
+        if self.pending >= FLUSH_BATCH:
+            self.flush_event.set()
+
+    def flush_loop(self):
+        while True:
+            self.flush_event.wait(DURABILITY_WINDOW)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"خطأ في حفظ البيانات: {e}")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # قبل اكتمال التحميل ما فيه شي نحفظه، والحفظ وقتها يمسح الإحصائيات المحفوظة
+        if not self.ready.is_set():
+            return
+        try:
+            self.flush()
+            self.stats.save()
+        except Exception as e:
+            logging.error(f"خطأ في حفظ البيانات عند الإيقاف: {e}")
+
+    @abstractmethod
+    def get_user(self, user_id):
+        pass
+
+    @abstractmethod
+    def ensure_user(self, user_id):
+        pass
+
+    @abstractmethod
+    def add_points(self, user_id, points, referrals=0):
+        pass
+
+    @abstractmethod
+    def count_bots(self, user_id):
+        pass
+
+    @abstractmethod
+    def get_bots(self, user_id, offset=0, limit=None):
+        pass
+
+    @abstractmethod
+    def get_bot(self, user_id, bot_index):
+        pass
+
+    @abstractmethod
+    def add_bot(self, user_id, bot_item):
+        pass
+
+    @abstractmethod
+    def update_bot(self, user_id, bot_index, bot_item):
+        pass
+
+    @abstractmethod
+    def delete_bot(self, user_id, bot_index):
+        pass
+
+    @abstractmethod
+    def verify_bot(self, user_id, bot_id):
+        # بالرقم الثابت (BotRecord.id أو صف SQLite) بدل الموقع: زر الاعتماد ينعرض قبل الضغط بفترة، والتعديل أو
+        # الحذف بينهم يغير المواقع. يرجع None لو البوت انحذف أو انعتمد قبل
+        pass
+
+    @abstractmethod
+    def get_verified_bots(self):
+        pass
+
+    @abstractmethod
+    def get_verified_bot(self, index):
+        pass
+
+    @abstractmethod
+    def build_search_index(self):
+        pass
+
+    @abstractmethod
+    def rebuild_stats(self):
+        pass
+
+    @abstractmethod
+    def bot_position(self, doc_id, owner):
+        pass
+
+    def search_bots(self, user_id, query, offset=0, limit=SEARCH_PAGE_SIZE):
+        # النتائج: بوتات المستخدم نفسه + البوتات المعتمدة، مع موقع كل بوت في قائمته
+        total, hits = self.search_index.search(query, (int(user_id), VERIFIED_OWNER), offset, limit)
+        results = []
+        for doc_id, owner, bot_item in hits:
+            position = self.bot_position(doc_id, owner)
+            if position is not None:
+                results.append((owner == VERIFIED_OWNER, position, bot_item))
+        return total, results
+
+    @abstractmethod
+    def bot_page(self, before, limit, unverified_only):
+        pass
+
+    def page_bots(self, before=None, limit=ADMIN_PAGE_SIZE, unverified_only=True):
+        # keyset: أحدث البوتات أولًا، وbefore رقم آخر بوت في الصفحة السابقة
+        page = []
+        for doc_id, owner, bot_item in self.bot_page(LAST_ID if before is None else before, limit, unverified_only):
+            position = self.bot_position(doc_id, owner)
+            if position is not None:
+                page.append((doc_id, owner, position, bot_item))
+        return page
+
+    @abstractmethod
+    def page_users(self, order="points", after=None, limit=ADMIN_PAGE_SIZE):
+        # order: points أو referrals (الأعلى أولًا، after = (القيمة، معرف)) أو id (تصاعدي، after = معرف)
+        pass
+
+    @abstractmethod
+    def user_position(self, user_id):
+        # (ترتيب المستخدم حسب النقاط، عدد المستخدمين)؛ المتساويين بالنقاط لهم نفس الترتيب
+        pass
+
+    @abstractmethod
+    def count_users(self):
+        pass
+
+# سجلات الذاكرة بـ __slots__ بدل dict لكل مستخدم وبوت: بدون جدول مفاتيح لكل كائن، والنصوص المتكررة
+# (نفس اللينك أو الاسم عند أكثر من مستخدم) نسخة وحدة بـ sys.intern. القراءة بالأقواس (bot["name"]) تبقى شغالة
+# فالهاندلرز ما تفرق بينها وبين صفوف SQLite، والتحويل لـ dict بس عند الكتابة للملفات
+class BotRecord:
+    # id: رقم تسلسلي ثابت بترتيب الإضافة (تخزين JSON)، يبقى مع البوت عند التعديل والاعتماد
+    __slots__ = ("id", "link", "description", "name")
+
+    def __init__(self, link, description, name, bot_id=None):
+        self.id = bot_id
+        self.link = link
+        self.description = description
+        self.name = name
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to_dict(self):
+        bot_item = {"link": self.link, "description": self.description, "name": self.name}
+        if self.id is not None:
+            bot_item["id"] = self.id
+        return bot_item
+
+class UserRecord:
+    __slots__ = ("points", "referrals", "bots")
+
+    def __init__(self, points=0, referrals=0, bots=()):
+        self.points = points
+        self.referrals = referrals
+        # أغلب المستخدمين بدون بوتات: tuple فاضي مشترك بدل قائمة لكل مستخدم، والقائمة تنشأ مع أول بوت
+        self.bots = bots
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to_dict(self):
+        return {"points": self.points, "referrals": self.referrals, "bots": [bot_item.to_dict() for bot_item in self.bots]}
+
+    @classmethod
+    def from_dict(cls, user_data):
+        bots = user_data.get("bots")
+        return cls(user_data.get("points", 0), user_data.get("referrals", 0),
+                   [make_bot_item(bot_item, bot_item.get("id")) for bot_item in bots] if bots else ())
+
+def make_bot_item(bot_item, bot_id=None):
+    return BotRecord(sys.intern(bot_item["link"]), sys.intern(bot_item["description"]), sys.intern(bot_item["name"]), bot_id)
+
+def assign_bot_ids(data):
+    # بوتات محفوظة قبل ما يصير لها رقم: تاخذ أرقام بعد أكبر رقم موجود بترتيب الملف. يرجع أكبر رقم وعدد اللي انضافت
+    bots = [bot_item for user_data in data["users"].values() for bot_item in user_data.bots] + data["verified_bots"]
+    last_id = max((bot_item.id for bot_item in bots if bot_item.id is not None), default=0)
+    assigned = 0
+    for bot_item in bots:
+        if bot_item.id is None:
+            last_id += 1
+            bot_item.id = last_id
+            assigned += 1
+    return last_id, assigned
+
+def write_jsonl_snapshot(data, path):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        for uid, user_data in data["users"].items():
+            f.write(json.dumps({"op": "user", "id": str(uid), "data": user_data.to_dict()}, ensure_ascii=False) + "\n")
+        for index, bot_item in enumerate(data["verified_bots"]):
+            f.write(json.dumps({"op": "verified", "index": index, "data": bot_item.to_dict()}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+def migrate_legacy_data(legacy_file=LEGACY_DATA_FILE, data_file=DATA_FILE):
+    # تحويل لمرة وحدة من users.json إلى users.jsonl؛ الملف القديم يبقى كنسخة احتياطية باسم .bak
+    if not os.path.exists(legacy_file) or os.path.exists(data_file):
+        return False
+    started = time.time()
+    with open(legacy_file, "r", encoding="utf-8") as f:
+        legacy = json.load(f)
+    data = {"users": {int(uid): UserRecord.from_dict(user_data) for uid, user_data in legacy.get("users", {}).items()},
+            "verified_bots": [make_bot_item(bot_item) for bot_item in legacy.get("verified_bots", [])]}
+    write_jsonl_snapshot(data, data_file)
+    os.replace(legacy_file, legacy_file + ".bak")
+    logging.info(f"تم تحويل {legacy_file} إلى {data_file} ({len(data['users'])} مستخدم) في {time.time() - started:.2f} ثانية")
+    return True
+
+# تخزين JSON: لقطة (snapshot) + سجل (journal) يُضاف له كل تعديل كسطر بدل إعادة كتابة الملف كامل
+class JsonStorage(Storage):
+    def __init__(self, data_file, journal_file):
+        super().__init__()
+        self.data_file = data_file
+        self.journal_path = journal_file
+        self.io_lock = threading.Lock()
+        self.compact_event = threading.Event()
+        # التعديلات اللي لسه ما انكتبت؛ سجل المستخدم يتكرر بنفس المفتاح فيبقى آخر نسخة بس
+        self.buffer = OrderedDict()
+        # أرقام مستندات فهرس البحث بنفس ترتيب قوائم البوتات (للمستخدمين اللي عندهم بوتات بس)
+        self.bot_ids = {}
+        self.verified_ids = {}
+        self.bot_seq = 0  # آخر رقم بوت (BotRecord.id)، وهو نفسه رقم المستند في فهرس البحث
+        # فهارس مرتبة لصفحات الأدمن والمتصدرين: أرقام البوتات الحية (ترتيب الإضافة)، (-نقاط، معرف)، (-إحالات، معرف)، والمعرفات.
+        # التعديل insort/del (نقل ذاكرة بـ C) والبحث bisect بـ O(log n) بدل ترتيب كل المستخدمين مع كل طلب
+        self.bot_order = []
+        self.points_order = []
+        self.referrals_order = []
+        self.user_order = []
+        # المستخدمين بمفتاح رقمي (int) وقيم UserRecord؛ الملفات تبقى بنفس الصيغة (المعرف نص والسجل dict)
+        self.data = {"users": {}, "verified_bots": []}
+        self.journal = None
+
+    def read_data(self):
+        # يرجع البيانات وقائمة الملفات اللي وقفت قراءتها عند سطر تالف
+        migrate_legacy_data(LEGACY_DATA_FILE, self.data_file)
+        data = {"users": {}, "verified_bots": []}
+        damaged = [path for path in (self.data_file, self.journal_path + ".old", self.journal_path)
+                   if self.replay_journal(data, path)]
+        return data, damaged
+
+    def load(self):
+        data, damaged = self.read_data()
+        bot_seq, assigned = assign_bot_ids(data)
+        with self.lock:
+            self.data = data
+            self.bot_seq = bot_seq
+        if assigned or damaged or not os.path.exists(self.data_file):
+            # الأرقام الجديدة لازم تنحفظ قبل أي سطر بالسجل، وإلا إعادة تطبيق السجل القديم (بدون أرقام)
+            # بعد إعادة التشغيل تعطي نفس البوتات أرقام ثانية. وبعد سطر تالف نبدأ بسجل فاضي: الإضافة
+            # بعده تنكتب ورا السطر التالف، وإعادة التحميل أو الضغط توقف عنده فتضيع كل التعديلات الجديدة
+            self.write_snapshot(self.data)
+            for path in (self.journal_path + ".old", self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            if assigned:
+                logging.info(f"تم ترقيم {assigned} بوت محفوظ بدون رقم")
+            if damaged:
+                logging.warning(f"تم حفظ لقطة جديدة بعد سطر تالف في {', '.join(damaged)}")
+        self.journal = open(self.journal_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def apply_journal_entry(data, entry):
+        if entry["op"] == "user":
+            data["users"][int(entry["id"])] = UserRecord.from_dict(entry["data"])
+        elif entry["op"] == "verified":
+            # بموقعه في القائمة: لو توقف الضغط بعد كتابة اللقطة وقبل حذف السجل القديم، إعادة تطبيق
+            # السجل فوق لقطة فيها نفس البوتات ما تكررها (الأسطر القديمة بدون index تنضاف بالآخر)
+            verified_bots = data["verified_bots"]
+            bot_item = make_bot_item(entry["data"], entry["data"].get("id"))
+            index = entry.get("index")
+            if index is not None and index < len(verified_bots):
+                verified_bots[index] = bot_item
+            else:
+                verified_bots.append(bot_item)
+
+    def replay_journal(self, data, path):
+        # يرجع True لو الملف انتهى بسطر تالف أو ناقص (توقف مفاجئ أثناء الكتابة)
+        if not os.path.exists(path):
+            return False
+        with open(path, "r", encoding="utf-8") as f:
+            while True:
+                # نحلل دفعة أسطر كمصفوفة وحدة (أسرع من json.loads لكل سطر) والذاكرة محدودة بحجم الدفعة
+                lines = list(itertools.islice(f, REPLAY_BATCH))
+                if not lines:
+                    return False
+                try:
+                    entries = json.loads("[" + ",".join(lines) + "]")
+                except ValueError:
+                    entries = []
+                    for line in lines:
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            # آخر سطر ناقص بسبب توقف مفاجئ أثناء الكتابة
+                            logging.warning(f"تم تجاهل سطر تالف في {path}")
+                            break
+                for entry in entries:
+                    self.apply_journal_entry(data, entry)
+                # سطر كامل بدون "\n" بالآخر يتحلل، بس أي إضافة بعده تلتصق فيه بنفس السطر
+                if len(entries) < len(lines) or not lines[-1].endswith("\n"):
+                    return True
+
+    def load_snapshot(self):
+        # اللقطة بنفس صيغة السجل، فتنقرأ سطر سطر بدل تحميل الملف كامل ثم تحليله
+        data = {"users": {}, "verified_bots": []}
+        self.replay_journal(data, self.data_file)
+        self.replay_journal(data, self.journal_path + ".old")
+        return data
+
+    def write_snapshot(self, data):
+        write_jsonl_snapshot(data, self.data_file)
+
+    def append_journal(self, key, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.buffer.pop(key, None)
+            self.buffer[key] = line
+            self.mark_dirty()
+
+    def save_user(self, user_id):
+        user_data = self.data["users"].get(int(user_id))
+        if user_data is not None:
+            self.append_journal(("user", int(user_id)), {"op": "user", "id": str(user_id), "data": user_data.to_dict()})
+
+    def save_verified_bot(self, index, bot_item):
+        self.append_journal(("verified", index), {"op": "verified", "index": index, "data": bot_item.to_dict()})
+
+    def write_pending(self):
+        # لازم يتنادى مع io_lock: كتابة وfsync واحد لكل الدفعة
+        with self.lock:
+            if not self.buffer:
+                return
+            batch = self.buffer
+            self.buffer = OrderedDict()
+            self.pending = 0
+        start = os.fstat(self.journal.fileno()).st_size
+        try:
+            self.journal.write("".join(batch.values()))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except OSError:
+            # القرص ممتلئ أو خطأ إدخال/إخراج: الدفعة ترجع للمخزن المؤقت وتنكتب بالمحاولة الجاية (الأحدث لنفس
+            # المفتاح يبقى)، ونشيل أي جزء انكتب منها عشان ما يبقى سطر ناقص بنص السجل يوقف إعادة التحميل
+            with self.lock:
+                for key, line in self.buffer.items():
+                    batch.pop(key, None)
+                    batch[key] = line
+                self.buffer = batch
+                self.pending = len(batch)
+            try:
+                self.journal.close()
+            except OSError:
+                pass
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(start)
+            self.journal = open(self.journal_path, "a", encoding="utf-8")
+            raise
+        if self.journal.tell() > JOURNAL_MAX_BYTES:
+            self.compact_event.set()
+
+    def flush(self):
+        with self.io_lock:
+            self.write_pending()
+
+    def compact(self):
+        # ندوّر السجل تحت القفل (عملية سريعة) ونبني اللقطة الجديدة من الملفات خارج القفل
+        old_journal = self.journal_path + ".old"
+        with self.io_lock:
+            self.write_pending()
+            if not os.path.exists(old_journal):
+                if self.journal.tell() == 0:
+                    return
+                self.journal.close()
+                os.replace(self.journal_path, old_journal)
+                self.journal = open(self.journal_path, "a", encoding="utf-8")
+        self.write_snapshot(self.load_snapshot())
+        os.remove(old_journal)
+
+    def compaction_loop(self):
+        self.ready.wait()
+        while True:
+            self.compact_event.wait(COMPACT_INTERVAL)
+            self.compact_event.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error(f"خطأ في ضغط السجل: {e}")
+
+    def start(self):
+        super().start()
+        threading.Thread(target=self.compaction_loop, daemon=True).start()
+
+    def get_user(self, user_id):
+        return self.data["users"].get(int(user_id))
+
+    def ensure_user(self, user_id):
+        with self.lock:
+            if int(user_id) in self.data["users"]:
+                return False
+            self.user_record(user_id)
+            self.save_user(user_id)
+            return True
+
+    def user_record(self, user_id):
+        uid = int(user_id)
+        user_data = self.data["users"].get(uid)
+        if user_data is None:
+            user_data = self.data["users"][uid] = UserRecord()
+            self.stats.user_added()
+            insort(self.points_order, (0, uid))
+            insort(self.referrals_order, (0, uid))
+            insort(self.user_order, uid)
+        return user_data
+
+    def add_points(self, user_id, points, referrals=0):
+        with self.lock:
+            uid = int(user_id)
+            user_data = self.user_record(uid)
+            del self.points_order[bisect_left(self.points_order, (-user_data.points, uid))]
+            insort(self.points_order, (-(user_data.points + points), uid))
+            if referrals:
+                del self.referrals_order[bisect_left(self.referrals_order, (-user_data.referrals, uid))]
+                insort(self.referrals_order, (-(user_data.referrals + referrals), uid))
+            user_data.points += points
+            user_data.referrals += referrals
+            self.stats.points_added(points, referrals)
+            self.save_user(uid)
+
+    def user_bots(self, user_id):
+        user_data = self.data["users"].get(int(user_id))
+        return user_data.bots if user_data is not None else ()
+
+    def count_bots(self, user_id):
+        return len(self.user_bots(user_id))
+
+    def get_bots(self, user_id, offset=0, limit=None):
+        bots = self.user_bots(user_id)
+        return list(bots[offset:] if limit is None else bots[offset:offset + limit])
+
+    def get_bot(self, user_id, bot_index):
+        bots = self.user_bots(user_id)
+        return bots[bot_index] if 0 <= bot_index < len(bots) else None
+
+    def index_bot(self, owner, bot_item):
+        self.search_index.add(bot_item.id, owner, bot_item)
+        return bot_item.id
+
+    def build_search_index(self):
+        with self.lock:
+            for uid, user_data in self.data["users"].items():
+                if user_data.bots:
+                    self.bot_ids[uid] = [self.index_bot(uid, bot_item) for bot_item in user_data.bots]
+            for position, bot_item in enumerate(self.data["verified_bots"]):
+                self.verified_ids[self.index_bot(VERIFIED_OWNER, bot_item)] = position
+            # ترتيب الإضافة الفعلي (أرقام ثابتة من الملف)، فصفحات الأدمن ومؤشراتها ما تتغير مع إعادة التشغيل
+            self.bot_order = sorted(self.search_index.docs)
+
+    def rebuild_stats(self):
+        # نفس المرور يبني ترتيب المستخدمين لصفحات الأدمن
+        bots = referrals = points = 0
+        points_order = []
+        referrals_order = []
+        with self.lock:
+            for uid, user_data in self.data["users"].items():
+                bots += len(user_data.bots)
+                referrals += user_data.referrals
+                points += user_data.points
+                points_order.append((-user_data.points, uid))
+                referrals_order.append((-user_data.referrals, uid))
+            self.stats.reset(len(self.data["users"]), bots, len(self.data["verified_bots"]), referrals, points)
+            points_order.sort()
+            referrals_order.sort()
+            self.points_order = points_order
+            self.referrals_order = referrals_order
+            self.user_order = sorted(uid for _, uid in points_order)
+
+    def bot_position(self, doc_id, owner):
+        with self.lock:
+            if owner == VERIFIED_OWNER:
+                return self.verified_ids.get(doc_id)
+            ids = self.bot_ids.get(owner, ())
+            return ids.index(doc_id) if doc_id in ids else None
+
+    def add_bot(self, user_id, bot_item):
+        with self.lock:
+            uid = int(user_id)
+            user_data = self.user_record(uid)
+            self.bot_seq += 1
+            bot_item = make_bot_item(bot_item, self.bot_seq)
+            if not user_data.bots:
+                user_data.bots = []
+            user_data.bots.append(bot_item)
+            self.bot_ids.setdefault(uid, []).append(self.index_bot(uid, bot_item))
+            self.bot_order.append(bot_item.id)
+            self.stats.bot_added()
+            self.save_user(uid)
+
+    def update_bot(self, user_id, bot_index, bot_item):
+        with self.lock:
+            uid = int(user_id)
+            bots = self.data["users"][uid].bots
+            bot_item = make_bot_item(bot_item, bots[bot_index].id)
+            bots[bot_index] = bot_item
+            self.search_index.add(self.bot_ids[uid][bot_index], uid, bot_item)
+            self.save_user(uid)
+
+    def pop_bot(self, uid, bot_index):
+        bot_item = self.data["users"][uid].bots.pop(bot_index)
+        ids = self.bot_ids[uid]
+        doc_id = ids.pop(bot_index)
+        if not ids:
+            del self.bot_ids[uid]
+        return bot_item, doc_id
+
+    def delete_bot(self, user_id, bot_index):
+        with self.lock:
+            uid = int(user_id)
+            _, doc_id = self.pop_bot(uid, bot_index)
+            self.search_index.remove(doc_id)
+            del self.bot_order[bisect_left(self.bot_order, doc_id)]
+            self.stats.bot_deleted()
+            self.save_user(uid)
+
+    def verify_bot(self, user_id, bot_id):
+        with self.lock:
+            uid = int(user_id)
+            ids = self.bot_ids.get(uid, ())
+            if bot_id not in ids:
+                return None
+            bot_item, doc_id = self.pop_bot(uid, ids.index(bot_id))
+            position = len(self.data["verified_bots"])
+            self.verified_ids[doc_id] = position
+            self.data["verified_bots"].append(bot_item)
+            self.search_index.set_owner(doc_id, VERIFIED_OWNER)
+            self.stats.bot_verified()
+            self.save_verified_bot(position, bot_item)
+            self.save_user(uid)
+            return bot_item
+
+    def get_verified_bots(self):
+        return self.data["verified_bots"]
+
+    def get_verified_bot(self, index):
+        verified_bots = self.data["verified_bots"]
+        return verified_bots[index] if 0 <= index < len(verified_bots) else None
+
+    def bot_page(self, before, limit, unverified_only):
+        page = []
+        with self.lock:
+            i = bisect_left(self.bot_order, before)
+            while i > 0 and len(page) < limit:
+                i -= 1
+                owner, bot_item = self.search_index.get(self.bot_order[i])
+                if not (unverified_only and owner == VERIFIED_OWNER):
+                    page.append((self.bot_order[i], owner, bot_item))
+        return page
+
+    def page_users(self, order="points", after=None, limit=ADMIN_PAGE_SIZE):
+        with self.lock:
+            if order in ("points", "referrals"):
+                index = self.points_order if order == "points" else self.referrals_order
+                start = 0 if after is None else bisect_right(index, (-after[0], after[1]))
+                uids = [uid for _, uid in index[start:start + limit]]
+            else:
+                start = 0 if after is None else bisect_right(self.user_order, after)
+                uids = self.user_order[start:start + limit]
+            return [(uid, self.data["users"][uid]) for uid in uids]
+
+    def user_position(self, user_id):
+        with self.lock:
+            user_data = self.data["users"].get(int(user_id))
+            points = user_data.points if user_data else 0
+            # (-نقاط، -1) يجي قبل كل المستخدمين بنفس النقاط، فالموقع = عدد اللي نقاطهم أعلى + 1
+            return bisect_left(self.points_order, (-points, -1)) + 1, len(self.data["users"])
+
+    def count_users(self):
+        return len(self.data["users"])
+
+# تخزين SQLite: جداول مفهرسة واستعلامات ثابتة (sqlite3 يخزن الاستعلامات المحضرة في cache)
+class SqliteStorage(Storage):
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            points INTEGER NOT NULL DEFAULT 0,
+            referrals INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS bots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            description TEXT NOT NULL,
+            link TEXT NOT NULL,
+            verified INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS bots_user ON bots (user_id, verified, id);
+        CREATE INDEX IF NOT EXISTS bots_verified ON bots (verified, id);
+        CREATE INDEX IF NOT EXISTS bots_name ON bots (name);
+        CREATE INDEX IF NOT EXISTS users_points ON users (points DESC, user_id);
+        CREATE INDEX IF NOT EXISTS users_referrals ON users (referrals DESC, user_id);
+    """
+    # في وضع العنقود كل عملية عندها فهرس بحث بالذاكرة، فتعديلات البوتات تنسجل هنا وكل عامل يلتقطها
+    CLUSTER_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS bot_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            bot_id INTEGER NOT NULL,
+            changed INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        );
+        CREATE TRIGGER IF NOT EXISTS bots_insert AFTER INSERT ON bots BEGIN INSERT INTO bot_changes (bot_id) VALUES (NEW.id); END;
+        CREATE TRIGGER IF NOT EXISTS bots_update AFTER UPDATE ON bots BEGIN INSERT INTO bot_changes (bot_id) VALUES (NEW.id); END;
+        CREATE TRIGGER IF NOT EXISTS bots_delete AFTER DELETE ON bots BEGIN INSERT INTO bot_changes (bot_id) VALUES (OLD.id); END;
+    """
+    SINGLE_SCHEMA = """
+        DROP TRIGGER IF EXISTS bots_insert;
+        DROP TRIGGER IF EXISTS bots_update;
+        DROP TRIGGER IF EXISTS bots_delete;
+        DROP TABLE IF EXISTS bot_changes;
+    """
+    CHANGE_RETENTION = 3600
+    # موقع البوت في قائمة المستخدم = ترتيبه حسب id بين بوتاته غير المعتمدة
+    BOT_ID_AT = "SELECT id FROM bots WHERE user_id = ? AND verified = 0 ORDER BY id LIMIT 1 OFFSET ?"
+
+    def __init__(self, db_file):
+        super().__init__()
+        # في وضع العنقود عدة عمليات تكتب بنفس القاعدة، وtransaction مفتوحة لين الـ flush تقفل الكتابة على الباقين،
+        # فكل تعديل ينحفظ لحاله (autocommit)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, cached_statements=256,
+                                    isolation_level=None if CLUSTER_WORKERS else "")
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.change_seq = 0
+        self.conn.executescript(self.CLUSTER_SCHEMA if CLUSTER_WORKERS else self.SINGLE_SCHEMA)
+        self.rank_cache = OrderedDict()  # المستخدم -> (وقت الانتهاء، ترتيبه)
+
+    def import_json(self, data):
+        with self.lock, self.conn:
+            for uid, user_data in data["users"].items():
+                self.conn.execute("INSERT OR REPLACE INTO users (user_id, points, referrals) VALUES (?, ?, ?)",
+                                  (uid, user_data.points, user_data.referrals))
+                # رقم البوت من JSON (ترتيب الإضافة) يصير id الصف، فترتيب صفحات الأدمن ما يتغير بعد التحويل
+                for bot_item in user_data.bots:
+                    self.conn.execute("INSERT INTO bots (id, user_id, name, description, link) VALUES (?, ?, ?, ?, ?)",
+                                      (bot_item.id, uid, bot_item.name, bot_item.description, bot_item.link))
+            for bot_item in data["verified_bots"]:
+                self.conn.execute("INSERT INTO bots (id, user_id, name, description, link, verified) VALUES (?, 0, ?, ?, ?, 1)",
+                                  (bot_item.id, bot_item.name, bot_item.description, bot_item.link))
+
+    def query(self, sql, params=()):
+        # الاتصال مشترك بين خيوط العمال، فكل استعلام يمر عبر القفل
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def build_search_index(self):
+        if CLUSTER_WORKERS:
+            self.change_seq = self.query("SELECT COALESCE(MAX(seq), 0) FROM bot_changes")[0][0]
+        for row in self.query("SELECT id, user_id, verified, name, description, link FROM bots"):
+            self.search_index.add(row["id"], VERIFIED_OWNER if row["verified"] else row["user_id"], self.row_to_bot(row))
+
+    def sync_changes(self):
+        # الحالة الحالية للبوت (مو التعديل نفسه) فتطبيق نفس التغيير مرتين ما يضر، حتى تعديلات العملية نفسها
+        rows = self.query(
+            "SELECT c.seq, c.bot_id, b.user_id, b.verified, b.name, b.description, b.link"
+            " FROM bot_changes c LEFT JOIN bots b ON b.id = c.bot_id WHERE c.seq > ? ORDER BY c.seq",
+            (self.change_seq,)
+        )
+        for row in rows:
+            if row["user_id"] is None:
+                self.search_index.remove(row["bot_id"])
+            else:
+                self.search_index.add(row["bot_id"], VERIFIED_OWNER if row["verified"] else row["user_id"], self.row_to_bot(row))
+            self.change_seq = row["seq"]
+
+    def cluster_sync_loop(self):
+        last_stats = time.time()
+        while True:
+            time.sleep(CLUSTER_SYNC_INTERVAL)
+            try:
+                self.sync_changes()
+                if time.time() - last_stats >= CLUSTER_STATS_INTERVAL:
+                    last_stats = time.time()
+                    self.rebuild_stats()
+                    with self.lock, self.conn:
+                        self.conn.execute("DELETE FROM bot_changes WHERE changed < ?", (time.time() - self.CHANGE_RETENTION,))
+            except Exception as e:
+                logging.error(f"خطأ في مزامنة تعديلات العنقود: {e}")
+
+    def warm_up(self):
+        super().warm_up()
+        if CLUSTER_WORKERS:
+            threading.Thread(target=self.cluster_sync_loop, name="ClusterSync", daemon=True).start()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT NOT EXISTS (SELECT 1 FROM users)").fetchone()[0] == 1
+
+    @staticmethod
+    def row_to_bot(row):
+        return make_bot_item(row)
+
+    def get_user(self, user_id):
+        rows = self.query("SELECT points, referrals FROM users WHERE user_id = ?", (int(user_id),))
+        return {"points": rows[0]["points"], "referrals": rows[0]["referrals"]} if rows else None
+
+    def ensure_user(self, user_id):
+        with self.lock:
+            created = self.insert_user(user_id)
+            if created:
+                self.mark_dirty()
+            return created
+
+    def insert_user(self, user_id):
+        created = self.conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (int(user_id),)).rowcount == 1
+        if created:
+            self.stats.user_added()
+        return created
+
+    def add_points(self, user_id, points, referrals=0):
+        with self.lock:
+            self.insert_user(user_id)
+            self.conn.execute("UPDATE users SET points = points + ?, referrals = referrals + ? WHERE user_id = ?",
+                              (points, referrals, int(user_id)))
+            self.rank_cache.pop(int(user_id), None)
+            self.stats.points_added(points, referrals)
+            self.mark_dirty()
+
+    def count_bots(self, user_id):
+        return self.query("SELECT COUNT(*) FROM bots WHERE user_id = ? AND verified = 0", (int(user_id),))[0][0]
+
+    def get_bots(self, user_id, offset=0, limit=None):
+        rows = self.query(
+            "SELECT name, description, link FROM bots WHERE user_id = ? AND verified = 0 ORDER BY id LIMIT ? OFFSET ?",
+            (int(user_id), -1 if limit is None else limit, offset)
+        )
+        return [self.row_to_bot(row) for row in rows]
+
+    def get_bot(self, user_id, bot_index):
+        bots = self.get_bots(user_id, bot_index, 1) if bot_index >= 0 else []
+        return bots[0] if bots else None
+
+    def bot_id_at(self, user_id, bot_index):
+        rows = self.query(self.BOT_ID_AT, (int(user_id), bot_index))
+        if not rows:
+            raise IndexError(f"bot index {bot_index} out of range")
+        return rows[0]["id"]
+
+    def add_bot(self, user_id, bot_item):
+        with self.lock:
+            self.insert_user(user_id)
+            bot_id = self.conn.execute("INSERT INTO bots (user_id, name, description, link) VALUES (?, ?, ?, ?)",
+                                       (int(user_id), bot_item["name"], bot_item["description"], bot_item["link"])).lastrowid
+            self.search_index.add(bot_id, int(user_id), make_bot_item(bot_item))
+            self.stats.bot_added()
+            self.mark_dirty()
+
+    def update_bot(self, user_id, bot_index, bot_item):
+        with self.lock:
+            bot_id = self.bot_id_at(user_id, bot_index)
+            self.conn.execute("UPDATE bots SET name = ?, description = ?, link = ? WHERE id = ?",
+                              (bot_item["name"], bot_item["description"], bot_item["link"], bot_id))
+            self.search_index.add(bot_id, int(user_id), make_bot_item(bot_item))
+            self.mark_dirty()
+
+    def delete_bot(self, user_id, bot_index):
+        with self.lock:
+            bot_id = self.bot_id_at(user_id, bot_index)
+            self.conn.execute("DELETE FROM bots WHERE id = ?", (bot_id,))
+            self.search_index.remove(bot_id)
+            self.stats.bot_deleted()
+            self.mark_dirty()
+
+    def verify_bot(self, user_id, bot_id):
+        with self.lock:
+            if not self.conn.execute("UPDATE bots SET verified = 1 WHERE id = ? AND user_id = ? AND verified = 0",
+                                     (bot_id, int(user_id))).rowcount:
+                return None
+            row = self.conn.execute("SELECT name, description, link FROM bots WHERE id = ?", (bot_id,)).fetchone()
+            self.search_index.set_owner(bot_id, VERIFIED_OWNER)
+            self.stats.bot_verified()
+            self.mark_dirty()
+            return self.row_to_bot(row)
+
+    def flush(self):
+        with self.lock:
+            if self.conn.in_transaction:
+                self.conn.commit()
+            self.pending = 0
+
+    def get_verified_bots(self):
+        rows = self.query("SELECT name, description, link FROM bots WHERE verified = 1 ORDER BY id")
+        return [self.row_to_bot(row) for row in rows]
+
+    def get_verified_bot(self, index):
+        rows = self.query("SELECT name, description, link FROM bots WHERE verified = 1 ORDER BY id LIMIT 1 OFFSET ?", (index,)) if index >= 0 else []
+        return self.row_to_bot(rows[0]) if rows else None
+
+    def rebuild_stats(self):
+        row = self.query(
+            "SELECT (SELECT COUNT(*) FROM users), (SELECT COUNT(*) FROM bots WHERE verified = 0),"
+            " (SELECT COUNT(*) FROM bots WHERE verified = 1),"
+            " (SELECT COALESCE(SUM(referrals), 0) FROM users), (SELECT COALESCE(SUM(points), 0) FROM users)"
+        )[0]
+        self.stats.reset(*row)
+
+    def bot_position(self, doc_id, owner):
+        if owner == VERIFIED_OWNER:
+            rows = self.query("SELECT COUNT(*) FROM bots WHERE verified = 1 AND id < ?", (doc_id,))
+        else:
+            rows = self.query("SELECT COUNT(*) FROM bots WHERE user_id = ? AND verified = 0 AND id < ?", (owner, doc_id))
+        return rows[0][0]
+
+    def bot_page(self, before, limit, unverified_only):
+        if unverified_only:
+            sql = "SELECT id, user_id, verified, name, description, link FROM bots WHERE verified = 0 AND id < ? ORDER BY id DESC LIMIT ?"
+        else:
+            sql = "SELECT id, user_id, verified, name, description, link FROM bots WHERE id < ? ORDER BY id DESC LIMIT ?"
+        return [(row["id"], VERIFIED_OWNER if row["verified"] else row["user_id"], self.row_to_bot(row))
+                for row in self.query(sql, (before, limit))]
+
+    def page_users(self, order="points", after=None, limit=ADMIN_PAGE_SIZE):
+        if order in ("points", "referrals"):
+            # اسم العمود من قيمتين ثابتتين فقط، وكل عمود له فهرس (القيمة DESC، المعرف)
+            value, uid = after if after is not None else (LAST_ID, -1)
+            rows = self.query(
+                f"SELECT user_id, points, referrals FROM users WHERE {order} <= ? AND ({order} < ? OR user_id > ?)"
+                f" ORDER BY {order} DESC, user_id LIMIT ?",
+                (value, value, uid, limit)
+            )
+        else:
+            rows = self.query("SELECT user_id, points, referrals FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                              (-1 if after is None else after, limit))
+        return [(row["user_id"], {"points": row["points"], "referrals": row["referrals"]}) for row in rows]
+
+    def user_position(self, user_id):
+        # SQLite ما فيه فهرس ترتيب (order statistic)، فالـ COUNT على مدى users_points يمر على كل اللي فوق
+        # المستخدم. نحفظ الترتيب RANK_CACHE_TTL ثانية (يتصفر لما تتغير نقاطه هو)، والعدد من عدادات الإحصائيات
+        uid = int(user_id)
+        now = time.time()
+        with self.lock:
+            cached = self.rank_cache.get(uid)
+        if cached is None or cached[0] <= now:
+            rank = self.query(
+                "SELECT COUNT(*) FROM users WHERE points > COALESCE((SELECT points FROM users WHERE user_id = ?), 0)", (uid,)
+            )[0][0] + 1
+            with self.lock:
+                self.rank_cache.pop(uid, None)
+                self.rank_cache[uid] = (now + RANK_CACHE_TTL, rank)
+                if len(self.rank_cache) > RANK_CACHE_SIZE:
+                    self.rank_cache.popitem(last=False)
+        else:
+            rank = cached[1]
+        return rank, max(self.stats.users, rank)
+
+    def count_users(self):
+        return self.query("SELECT COUNT(*) FROM users")[0][0]
+
+def create_storage():
+    if STORAGE_BACKEND == "sqlite":
+        sqlite_storage = SqliteStorage(SQLITE_FILE)
+        # أول تشغيل: ننقل بيانات users.json القديمة لقاعدة البيانات
+        if sqlite_storage.is_empty() and (os.path.exists(DATA_FILE) or os.path.exists(LEGACY_DATA_FILE)):
+            sqlite_storage.import_json(JsonStorage(DATA_FILE, JOURNAL_FILE).read_data()[0])
+            logging.info("تم نقل البيانات من ملفات JSON إلى SQLite")
+        return sqlite_storage
+    return JsonStorage(DATA_FILE, JOURNAL_FILE)
+
+# تحميل البيانات
+try:
+    storage = create_storage()
+except Exception as e:
+    logging.error(f"خطأ في إنشاء أو تحميل ملف البيانات: {e}")
+    print(f"خطأ في إنشاء أو تحميل ملف البيانات: {e}")
+    exit()
+
+ADMIN_IDS = [7920989999]  # قائمة معرفات الأدمن
+
+DELETE_CHUNK = 100  # أقصى عدد رسائل في طلب deleteMessages واحد
+DELETE_MAX_RETRIES = 5
+
+# طابور حذف في الخلفية: نجمع الرسائل لكل شات ونحذفها بطلب deleteMessages واحد بدل طلب لكل رسالة
+class DeleteQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.pending = {}
+        self.retries = []  # heap: (وقت المحاولة, رقم, chat_id, الرسائل, المحاولة)
+        self.retry_seq = 0
+
+    def put(self, chat_id, message_ids):
+        if not message_ids:
+            return
+        log_context.deletes = getattr(log_context, "deletes", 0) + len(message_ids)
+        with self.lock:
+            self.pending.setdefault(chat_id, []).extend(message_ids)
+        self.event.set()
+
+    def start(self):
+        threading.Thread(target=self.run, name="DeleteQueue", daemon=True).start()
+
+    def schedule_retry(self, chat_id, message_ids, attempt, delay):
+        if attempt >= DELETE_MAX_RETRIES:
+            logging.warning(f"تم التخلي عن حذف {len(message_ids)} رسالة في {chat_id} بعد {attempt} محاولات")
+            return
+        with self.lock:
+            self.retry_seq += 1
+            heapq.heappush(self.retries, (time.time() + delay, self.retry_seq, chat_id, message_ids, attempt))
+        self.event.set()
+
+    def take_batch(self):
+        with self.lock:
+            batch = [(chat_id, message_ids, 0) for chat_id, message_ids in self.pending.items()]
+            self.pending = {}
+            now = time.time()
+            while self.retries and self.retries[0][0] <= now:
+                _, _, chat_id, message_ids, attempt = heapq.heappop(self.retries)
+                batch.append((chat_id, message_ids, attempt))
+        return batch
+
+    def next_retry_delay(self):
+        with self.lock:
+            return max(0, self.retries[0][0] - time.time()) if self.retries else None
+
+    def run(self):
+        while True:
+            self.event.wait(self.next_retry_delay())
+            self.event.clear()
+            for chat_id, message_ids, attempt in self.take_batch():
+                for i in range(0, len(message_ids), DELETE_CHUNK):
+                    self.delete_chunk(chat_id, message_ids[i:i + DELETE_CHUNK], attempt)
+
+    def delete_chunk(self, chat_id, message_ids, attempt):
+        try:
+            with outbound.priority(PRIORITY_NOTIFICATION):
+                bot.delete_messages(chat_id, message_ids)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = e.result_json.get("parameters", {}).get("retry_after", 1)
+                self.schedule_retry(chat_id, message_ids, attempt + 1, retry_after)
+            elif e.error_code in (400, 403):
+                # رسائل انحذفت أو صارت أقدم من 48 ساعة أو المستخدم حظر البوت: ما فيه فايدة من الإعادة
+                logging.debug(f"تم إسقاط حذف رسائل {chat_id}: {e.description}")
+            else:
+                self.schedule_retry(chat_id, message_ids, attempt + 1, 2 ** attempt)
+        except Exception as e:
+            logging.error(f"خطأ في حذف رسائل {chat_id}: {e}")
+            self.schedule_retry(chat_id, message_ids, attempt + 1, 2 ** attempt)
+
+delete_queue = DeleteQueue()
+
+BROADCAST_FILE = os.getenv("BROADCAST_FILE", "broadcast.json")  # تقدم الرسالة الجماعية والمحظورين، عشان تكمل بعد إعادة التشغيل
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", GLOBAL_RATE / 2))  # باقي الحد العام يبقى للردود التفاعلية
+BROADCAST_BATCH = 100  # عدد المستلمين في كل قراءة من التخزين وكل نقطة حفظ
+BROADCAST_THREADS = 4
+BROADCAST_PROGRESS_INTERVAL = 10
+
+# رسالة جماعية لكل المستخدمين: المستلمين ينقرؤوا من التخزين على دفعات بترتيب المعرف (keyset)،
+# والإرسال بأولوية الإشعارات وبسرعة BROADCAST_RATE، فالردود التفاعلية تمشي قبلها.
+# بعد كل دفعة ينحفظ آخر معرف وصله الإرسال، والمستخدمين اللي حظروا البوت ينجمعوا ويتخطوا بالمرات الجاية
+class Broadcaster:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.bucket = TokenBucket(BROADCAST_RATE, 1)
+        self.job = None
+        self.blocked = set()
+        self.thread = None
+        self.last_report = 0
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.job = data.get("job")
+        self.blocked = set(data.get("blocked", []))
+
+    def save(self):
+        with self.lock:
+            data = {"job": dict(self.job) if self.job else None, "blocked": sorted(self.blocked)}
+        write_json_atomic(self.path, data)
+
+    def running(self):
+        return self.job is not None and self.job["status"] == "running"
+
+    def begin(self, text, admin_chat):
+        with self.lock:
+            if self.running() or (self.thread and self.thread.is_alive()):
+                return False
+            self.job = {"text": text, "admin_chat": admin_chat, "message_id": None, "status": "running", "after": None,
+                        "total": storage.count_users() - len(self.blocked), "sent": 0, "blocked": 0, "failed": 0,
+                        "started": time.time()}
+        try:
+            message = bot.send_message(admin_chat, self.progress_text(), reply_markup=self.progress_markup())
+        except Exception:
+            # بدون رسالة التقدم ما يبدأ الإرسال، والحالة ما تبقى "running" بدون خيط فترفض كل رسالة جاية
+            with self.lock:
+                self.job["status"] = "failed"
+            self.save_quietly()
+            raise
+        self.job["message_id"] = message.message_id
+        self.save()
+        self.spawn()
+        return True
+
+    def pause(self):
+        with self.lock:
+            if self.running():
+                self.job["status"] = "paused"
+
+    def resume(self):
+        with self.lock:
+            if self.job is None or self.job["status"] != "paused" or (self.thread and self.thread.is_alive()):
+                return
+            self.job["status"] = "running"
+            self.job.pop("error", None)
+        self.spawn()
+
+    def unblock(self, user_id):
+        # المستخدم رجع وضغط /start، فيوصله الإرسال الجاي
+        if user_id in self.blocked:
+            with self.lock:
+                self.blocked.discard(user_id)
+
+    def spawn(self):
+        self.thread = threading.Thread(target=self.run, name="Broadcaster", daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                wait = self.bucket.delay(time.monotonic())
+                if wait <= 0:
+                    self.bucket.take()
+                    return
+            time.sleep(wait)
+
+    def deliver(self, user_id):
+        self.acquire()
+        try:
+            with outbound.priority(PRIORITY_NOTIFICATION):
+                bot.send_message(user_id, self.job["text"])
+            return "sent"
+        except ApiTelegramException as e:
+            # 403: حظر البوت أو حذف حسابه، و400 chat not found: ما بدأ محادثة أصلًا
+            if e.error_code == 403 or (e.error_code == 400 and "chat not found" in e.description):
+                return "blocked"
+            logging.warning(f"فشل إرسال الرسالة الجماعية إلى {user_id}: {e.description}")
+            return "failed"
+        except Exception as e:
+            logging.error(f"خطأ في إرسال الرسالة الجماعية إلى {user_id}: {e}")
+            return "failed"
+
+    def save_quietly(self):
+        try:
+            self.save()
+        except Exception as e:
+            logging.error(f"خطأ في حفظ تقدم الرسالة الجماعية: {e}")
+
+    def run(self):
+        try:
+            storage.ready.wait()
+            with ThreadPoolExecutor(BROADCAST_THREADS, thread_name_prefix="BroadcastSender") as executor:
+                while self.running():
+                    page = storage.page_users("id", self.job["after"], BROADCAST_BATCH)
+                    if not page:
+                        self.job["status"] = "done"
+                        break
+                    recipients = [uid for uid, _ in page if uid not in self.blocked]
+                    for uid, result in zip(recipients, executor.map(self.deliver, recipients)):
+                        self.job[result] += 1
+                        if result == "blocked":
+                            self.blocked.add(uid)
+                    self.job["after"] = page[-1][0]
+                    self.save_quietly()
+                    if time.time() - self.last_report >= BROADCAST_PROGRESS_INTERVAL:
+                        self.report()
+        except Exception as e:
+            # خطأ تخزين أو API: نوقف مؤقتًا بدل ما تبقى "running" بدون خيط. التقدم محفوظ لآخر دفعة كاملة،
+            # والأدمن يشوف الخطأ في رسالة التقدم ويستكمل منها
+            logging.error(f"خطأ في الرسالة الجماعية، تم إيقافها مؤقتًا: {e}")
+            with self.lock:
+                self.job["status"] = "paused"
+                self.job["error"] = str(e)
+        logging.info(f"الرسالة الجماعية {self.job['status']}: {self.job['sent']} وصلت، {self.job['blocked']} محظور، {self.job['failed']} فشل")
+        self.save_quietly()
+        self.report()
+
+    def progress_text(self):
+        job = self.job
+        labels = {"running": "⏳ جاري الإرسال", "paused": "⏸️ موقوفة مؤقتًا", "done": "✅ انتهت", "failed": "⚠️ ما بدأت"}
+        done = job["sent"] + job["blocked"] + job["failed"]
+        elapsed = max(time.time() - job["started"], 1)
+        text = (
+            f"📣 رسالة جماعية: {labels[job['status']]}\n"
+            f"التقدم: {done}/{max(job['total'], done)}\n"
+            f"✅ وصلت: {job['sent']} | 🚫 محظورين: {job['blocked']} | ⚠️ فشل: {job['failed']}\n"
+            f"السرعة: {done / elapsed:.1f} رسالة/ثانية"
+        )
+        if job.get("error"):
+            text += f"\n⚠️ توقفت بسبب خطأ: {job['error']}\nاضغط استكمال للمتابعة."
+        return text
+
+    def progress_markup(self):
+        return KEYBOARDS.get("broadcast_" + self.job["status"])
+
+    def report(self):
+        self.last_report = time.time()
+        if not self.job or not self.job["message_id"]:
+            return
+        try:
+            with outbound.priority(PRIORITY_NOTIFICATION):
+                bot.edit_message_text(self.progress_text(), self.job["admin_chat"], self.job["message_id"],
+                                      reply_markup=self.progress_markup())
+        except ApiTelegramException as e:
+            logging.debug(f"ما تحدثت رسالة تقدم الإرسال: {e.description}")
+        except Exception as e:
+            logging.error(f"خطأ في تحديث رسالة تقدم الإرسال: {e}")
+
+    def start(self):
+        try:
+            self.load()
+        except Exception as e:
+            logging.error(f"خطأ في تحميل حالة الرسالة الجماعية: {e}")
+        if self.running():
+            logging.info(f"استكمال الرسالة الجماعية بعد المستخدم {self.job['after']}")
+            self.spawn()
+
+broadcaster = Broadcaster(BROADCAST_FILE)
+
+def start_services():
+    update_log.start()
+    storage.start()
+    sessions.start()
+    outbound.start()
+    metrics.start()
+    api_cache.start()
+    delete_queue.start()
+    broadcaster.start()
+    if INGRESS == "webhook" and CLUSTER_WORKER is None:
+        threading.Thread(target=webhook_worker, name="WebhookWorker", daemon=True).start()
+
+warming_notified = set()  # الشاتات اللي وصلها تنبيه التجهيز أثناء التحميل
+
+def wait_for_storage(update):
+    # التحديثات اللي توصل أثناء التحميل تنتظر؛ ولو طال الانتظار نرد خلال STARTUP_BUDGET ثم نكمل لما يجهز
+    if storage.ready.wait(STARTUP_BUDGET):
+        return
+    message = getattr(update, "message", update)
+    chat = getattr(message, "chat", None)
+    if chat is not None and chat.id not in warming_notified:
+        warming_notified.add(chat.id)
+        try:
+            if isinstance(update, telebot.types.CallbackQuery):
+                bot.answer_callback_query(update.id, "⏳ البوت يجهز بياناته، لحظات...")
+            else:
+                bot.send_message(chat.id, "⏳ البوت يجهز بياناته، لحظات وراجع لك...")
+        except Exception as e:
+            logging.error(f"خطأ في إرسال تنبيه التجهيز إلى {chat.id}: {e}")
+    storage.ready.wait()
+
+# دوال مساعدة
+def get_rank(points):
+    try:
+        if points >= 100:
+            return "محترف"
+        elif points >= 50:
+            return "متوسط"
+        else:
+            return "مبتدئ"
+    except Exception as e:
+        logging.error(f"خطأ في تحديد الرتبة: {e}")
+        return "مبتدئ"
+
+def delete_previous_messages(chat_id, user_id, keep=None):
+    try:
+        session = sessions.get(user_id)
+        delete_queue.put(chat_id, [message_id for message_id in session.messages if message_id != keep])
+        session.messages.clear()
+    except Exception as e:
+        logging.error(f"خطأ في مسح الرسائل القديمة لـ {user_id}: {e}")
+
+def send_page(chat_id, user_id, text, markup=None, message_id=None):
+    # عند الضغط على زر نعدّل نفس الرسالة (طلب واحد) بدل حذف الرسائل وإرسال رسالة جديدة
+    if message_id is not None:
+        try:
+            delete_previous_messages(chat_id, user_id, keep=message_id)
+            bot.edit_message_text(text, chat_id, message_id, reply_markup=markup)
+            add_message_to_history(chat_id, user_id, message_id)
+            return
+        except ApiTelegramException as e:
+            if "message is not modified" in str(e):
+                add_message_to_history(chat_id, user_id, message_id)
+                return
+            # الرسالة قديمة أو ما تنعدل: نرجع للحذف والإرسال
+            add_message_to_history(chat_id, user_id, message_id)
+    delete_previous_messages(chat_id, user_id)
+    msg = bot.send_message(chat_id, text, reply_markup=markup)
+    add_message_to_history(chat_id, user_id, msg.message_id)
+
+def add_message_to_history(chat_id, user_id, message_id):
+    try:
+        sessions.get(user_id).messages.append(message_id)
+    except Exception as e:
+        logging.error(f"خطأ في إضافة رسالة للتاريخ لـ {user_id}: {e}")
+
+def add_to_page_history(user_id, page):
+    history = sessions.get(user_id).page_history
+    if not history or history[-1] != page:
+        history.append(page)
+
+# قوالب الكيبورد: الكيبوردات الثابتة تنبني وتتحول JSON مرة وحدة عند التشغيل،
+# والمتغيرة تنبني من صفوف JSON جاهزة بدل InlineKeyboardMarkup جديد مع كل ضغطة
+quote_json = json.encoder.encode_basestring
+
+def button(text, callback_data=None, url=None):
+    if url:
+        return f'{{"text": {quote_json(text)}, "url": {quote_json(url)}}}'
+    return f'{{"text": {quote_json(text)}, "callback_data": {quote_json(callback_data)}}}'
+
+def row(*buttons):
+    return "[" + ", ".join(buttons) + "]"
+
+class Keyboard(telebot.types.JsonSerializable):
+    __slots__ = ("json",)
+
+    def __init__(self, *rows):
+        self.json = '{"inline_keyboard": [' + ", ".join(rows) + "]}"
+
+    def to_json(self):
+        return self.json
+
+BACK_ROW = row(button("🏠 رجوع للقايمة الرئيسية", "main_menu"), button("⬅️ رجوع للسابقة", "go_back"))
+MAIN_MENU_ROWS = (
+    row(button("📁 ملفي", "my_profile"), button("📚 المكتبة", "library")),
+    row(button("👥 دعوة أصدقاء", "invite_friends"), button("📋 المهام", "tasks")),
+    row(button("⚙️ الإعدادات", "settings"), button("ℹ️ التعريف", "about")),
+    row(button("📩 شكوى", "complaint"), button("📊 الإحصائيات", "stats")),
+)
+
+# المفتاح مع لاحقة "_admin" نسخة الأدمن من نفس الكيبورد
+KEYBOARDS = {
+    "back": Keyboard(BACK_ROW),
+    "main_menu": Keyboard(*MAIN_MENU_ROWS),
+    "main_menu_admin": Keyboard(*MAIN_MENU_ROWS, row(button("🛠️ لوحة الأدمن", "admin_panel"))),
+    "library": Keyboard(
+        row(button("➕ إضافة بوت", "add_bot"), button("📜 بوتاتي", "my_bots_page_1")),
+        row(button("✅ البوتات المعتمدة", "verified_bots"), button("🔍 بحث", "search_bots")),
+        BACK_ROW
+    ),
+    "tasks": Keyboard(
+        row(button("📩 إرسال شكوى (10 نقاط)", "complaint"), button("👥 دعوة صديق (10 نقاط)", "invite_friends")),
+        BACK_ROW
+    ),
+    "settings": Keyboard(row(button("⚙️ لسه تحت التطوير", "under_dev")), BACK_ROW),
+    "my_profile": Keyboard(row(button("🏆 المتصدرين", "leaderboard")), BACK_ROW),
+    "leaderboard_points": Keyboard(row(button("👥 حسب الإحالات", "leaderboard_referrals")), BACK_ROW),
+    "leaderboard_referrals": Keyboard(row(button("⭐ حسب النقاط", "leaderboard")), BACK_ROW),
+    "admin_panel": Keyboard(
+        row(button("📚 إدارة المكتبة", "admin_library"), button("👤 إدارة المستخدمين", "admin_users")),
+        row(button("📋 إدارة المهام", "admin_tasks"), button("📊 إحصائيات المشروع", "admin_stats")),
+        row(button("🗑️ تنظيف القروب", "admin_clean"), button("⚙️ الإعدادات", "admin_settings")),
+        row(button("📣 رسالة جماعية", "admin_broadcast")),
+        BACK_ROW
+    ),
+    "admin_library": Keyboard(
+        row(button("📜 عرض البوتات", "admin_view_bots"), button("✅ اعتماد بوت", "admin_verify_bot")),
+        BACK_ROW
+    ),
+}
+# أزرار رسالة تقدم الإرسال الجماعي حسب حالته
+KEYBOARDS["broadcast_running"] = Keyboard(row(button("⏸️ إيقاف مؤقت", "admin_broadcast_pause"), button("🔄 تحديث", "admin_broadcast_status")))
+KEYBOARDS["broadcast_paused"] = Keyboard(row(button("▶️ استكمال", "admin_broadcast_resume"), button("🔄 تحديث", "admin_broadcast_status")))
+for cancel_data in ("cancel_add_bot", "cancel_search", "cancel_action"):
+    KEYBOARDS[cancel_data] = Keyboard(row(button("❌ إلغاء", cancel_data)))
+CONFIRM_KEYBOARDS = {}  # (تأكيد، تعديل، إلغاء) -> كيبورد، تنبني أول مرة وبس
+
+def keyboard(name, user_id=None):
+    if user_id in ADMIN_IDS:
+        return KEYBOARDS.get(name + "_admin") or KEYBOARDS[name]
+    return KEYBOARDS[name]
+
+def back_markup():
+    return KEYBOARDS["back"]
+
+def cancel_markup(callback_data="cancel_add_bot"):
+    return KEYBOARDS[callback_data]
+
+def confirm_markup(confirm, edit, cancel="cancel_add_bot"):
+    key = (confirm, edit, cancel)
+    markup = CONFIRM_KEYBOARDS.get(key)
+    if markup is None:
+        markup = CONFIRM_KEYBOARDS[key] = Keyboard(row(button("✅ تأكيد", confirm), button("✏️ تعديل", edit), button("❌ إلغاء", cancel)))
+    return markup
+
+def nav_row(*buttons):
+    # صف التنقل بين الصفحات، فاضي لو ما فيه أزرار
+    buttons = [item for item in buttons if item is not None]
+    return (row(*buttons),) if buttons else ()
+
+# القوائم
+def main_menu(chat_id, user_id, message_id=None):
+    try:
+        send_page(chat_id, user_id, "مرحبًا بك في البوت! اختر خيارًا:", keyboard("main_menu", user_id), message_id)
+        history = sessions.get(user_id).page_history
+        history.clear()
+        history.append("main_menu")
+    except Exception as e:
+        logging.error(f"فشل في إرسال القايمة الرئيسية لـ {user_id}: {e}")
+
+def library_menu(chat_id, user_id, message_id=None):
+    try:
+        send_page(chat_id, user_id, "📚 المكتبة:", keyboard("library"), message_id)
+        add_to_page_history(user_id, "library")
+    except Exception as e:
+        logging.error(f"فشل في إرسال قايمة المكتبة لـ {user_id}: {e}")
+
+def search_bots(chat_id, user_id, message_id=None):
+    try:
+        send_page(chat_id, user_id, "🔍 أرسل كلمة للبحث عن بوت (بالاسم أو الوصف):", keyboard("cancel_search"), message_id)
+        sessions.get(user_id).state = "searching_bots"
+        add_to_page_history(user_id, "search_bots")
+    except Exception as e:
+        logging.error(f"فشل في بدء البحث لـ {user_id}: {e}")
+
+def show_search_results(chat_id, user_id, query, page=1, message_id=None):
+    try:
+        total, results = storage.search_bots(user_id, query, (page - 1) * SEARCH_PAGE_SIZE, SEARCH_PAGE_SIZE)
+        sessions.get(user_id).inputs = {"search_query": query}
+        
+        if not results:
+            send_page(chat_id, user_id, "❌ لا توجد نتائج مطابقة!", back_markup(), message_id)
+            return
+        
+        rows = []
+        for verified, position, bot_item in results:
+            if verified:
+                rows.append(row(button(f"✅ {bot_item['name']}", f"verified_bot_{position}")))
+            else:
+                rows.append(row(button(f"{bot_item['name']}", f"view_bot_{position}")))
+        
+        total_pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+        markup = Keyboard(
+            *rows,
+            *nav_row(
+                button("⬅️ السابق", f"search_page_{page-1}") if page > 1 else None,
+                button("التالي ➡️", f"search_page_{page+1}") if page < total_pages else None
+            ),
+            BACK_ROW
+        )
+        
+        send_page(chat_id, user_id, f"🔍 نتائج البحث عن '{query}' ({total}) - صفحة {page}/{total_pages}:", markup, message_id)
+        add_to_page_history(user_id, "search_results")
+    except Exception as e:
+        logging.error(f"فشل في عرض نتائج البحث لـ {user_id}: {e}")
+
+def my_bots_menu(chat_id, user_id, page=1, message_id=None):
+    try:
+        bots_count = storage.count_bots(user_id)
+        
+        if not bots_count:
+            send_page(chat_id, user_id, "📜 لا يوجد بوتات مضافة!", back_markup(), message_id)
+            return
+        
+        items_per_page = 10
+        total_pages = (bots_count + items_per_page - 1) // items_per_page
+        page = max(1, min(page, total_pages))
+        start_idx = (page - 1) * items_per_page
+        current_bots = storage.get_bots(user_id, start_idx, items_per_page)
+        
+        markup = Keyboard(
+            *[row(button(f"{bot_item['name']}", f"view_bot_{start_idx + i}")) for i, bot_item in enumerate(current_bots)],
+            *nav_row(
+                button("⬅️ السابقة", f"my_bots_page_{page-1}") if page > 1 else None,
+                button("➡️ التالية", f"my_bots_page_{page+1}") if page < total_pages else None
+            ),
+            BACK_ROW
+        )
+        
+        send_page(chat_id, user_id, f"📜 بوتاتك (الصفحة {page} من {total_pages}):", markup, message_id)
+        add_to_page_history(user_id, "my_bots")
+        sessions.get(user_id).page = page
+    except Exception as e:
+        logging.error(f"فشل في إرسال قايمة بوتاتي لـ {user_id}: {e}")
+
+def view_bot_details(chat_id, user_id, bot_index, message_id=None):
+    try:
+        bot_item = storage.get_bot(user_id, bot_index)
+        
+        if bot_item is None:
+            send_page(chat_id, user_id, "❌ البوت غير موجود!", back_markup(), message_id)
+            return
+        
+        markup = Keyboard(
+            row(button("🔗 فتح البوت", url=bot_item["link"]), button("ℹ️ معلومات", f"show_bot_info_{bot_index}")),
+            row(button("✏️ تعديل", f"edit_bot_{bot_index}"), button("🗑️ حذف", f"confirm_delete_bot_{bot_index}")),
+            BACK_ROW
+        )
+        
+        send_page(chat_id, user_id, f"🤖 {bot_item['name']}", markup, message_id)
+        add_to_page_history(user_id, "view_bot")
+    except Exception as e:
+        logging.error(f"فشل في عرض تفاصيل البوت لـ {user_id}: {e}")
+
+def show_bot_info(chat_id, user_id, bot_index, message_id=None):
+    try:
+        bot_item = storage.get_bot(user_id, bot_index)
+        send_page(chat_id, user_id, f"ℹ️ معلومات {bot_item['name']}:\n{bot_item['description']}", back_markup(), message_id)
+        add_to_page_history(user_id, "show_bot_info")
+    except Exception as e:
+        logging.error(f"فشل في عرض معلومات البوت لـ {user_id}: {e}")
+
+def show_verified_bot(chat_id, user_id, index, message_id=None):
+    try:
+        bot_item = storage.get_verified_bot(index)
+        send_page(chat_id, user_id, f"✅ {bot_item['name']}\n{bot_item['description']}\n🔗 {bot_item['link']}", back_markup(), message_id)
+        add_to_page_history(user_id, "verified_bot")
+    except Exception as e:
+        logging.error(f"فشل في عرض البوت المعتمد لـ {user_id}: {e}")
+
+def admin_panel(chat_id, user_id, message_id=None):
+    try:
+        send_page(chat_id, user_id, "🛠️ لوحة الأدمن:", keyboard("admin_panel"), message_id)
+        add_to_page_history(user_id, "admin_panel")
+    except Exception as e:
+        logging.error(f"فشل في إرسال لوحة الأدمن لـ {user_id}: {e}")
+
+def admin_library_menu(chat_id, user_id, message_id=None):
+    try:
+        send_page(chat_id, user_id, "📚 إدارة المكتبة:", keyboard("admin_library"), message_id)
+        add_to_page_history(user_id, "admin_library")
+    except Exception as e:
+        logging.error(f"فشل في إرسال إدارة المكتبة لـ {user_id}: {e}")
+
+ADMIN_BOTS_FILTER_ROWS = {
+    True: row(button("📋 عرض الكل", "admin_view_bots_all")),
+    False: row(button("⏳ غير المعتمدة فقط", "admin_view_bots")),
+}
+ADMIN_USERS_ORDER_ROWS = {
+    "points": row(button("🔃 ترتيب حسب المعرف", "admin_users_id")),
+    "id": row(button("🔃 ترتيب حسب النقاط", "admin_users")),
+}
+
+def admin_view_bots(chat_id, user_id, before=None, unverified_only=True, message_id=None):
+    try:
+        # صفحة وحدة بس من الفهرس، والمؤشر (رقم آخر بوت) محمول في callback_data
+        page = storage.page_bots(before, ADMIN_PAGE_SIZE + 1, unverified_only)
+        mode = "u" if unverified_only else "a"
+        
+        if not page and before is None:
+            send_page(chat_id, user_id, "📜 لا يوجد بوتات مضافة!", back_markup(), message_id)
+            return
+        
+        rows = []
+        for doc_id, uid, bot_index, bot_item in page[:ADMIN_PAGE_SIZE]:
+            if uid == VERIFIED_OWNER:
+                rows.append(row(button(f"✅ {bot_item['name']}", f"verified_bot_{bot_index}")))
+            else:
+                rows.append(row(
+                    button(f"{bot_item['name']} (المستخدم: {uid})", f"view_admin_bot_{uid}_{bot_index}"),
+                    button("✅ اعتماد", f"verify_bot_{uid}_{doc_id}")
+                ))
+        markup = Keyboard(
+            *rows,
+            *nav_row(
+                button("⏮ الأحدث", "admin_view_bots" if unverified_only else "admin_view_bots_all") if before is not None else None,
+                button("التالي ➡️", f"admin_bots_{mode}_{page[ADMIN_PAGE_SIZE - 1][0]}") if len(page) > ADMIN_PAGE_SIZE else None
+            ),
+            ADMIN_BOTS_FILTER_ROWS[unverified_only],
+            BACK_ROW
+        )
+        
+        title = "📜 البوتات المضافة (غير المعتمدة، الأحدث أولًا):" if unverified_only else "📜 كل البوتات (الأحدث أولًا):"
+        send_page(chat_id, user_id, title, markup, message_id)
+        add_to_page_history(user_id, "admin_view_bots")
+    except Exception as e:
+        logging.error(f"فشل في عرض البوتات للأدمن لـ {user_id}: {e}")
+
+LEADERBOARD_MEDALS = ("🥇", "🥈", "🥉")
+
+def leaderboard_menu(chat_id, user_id, by="points", message_id=None):
+    try:
+        lines = []
+        for i, (uid, user_data) in enumerate(storage.page_users(by, None, LEADERBOARD_SIZE)):
+            place = LEADERBOARD_MEDALS[i] if i < len(LEADERBOARD_MEDALS) else f"{i + 1}."
+            you = " ⬅️ أنت" if uid == user_id else ""
+            if by == "points":
+                lines.append(f"{place} {uid} - {user_data['points']} نقطة ({get_rank(user_data['points'])}){you}")
+            else:
+                lines.append(f"{place} {uid} - {user_data['referrals']} إحالة{you}")
+        position, total = storage.user_position(user_id)
+        title = "🏆 المتصدرين بالنقاط:" if by == "points" else "🏆 المتصدرين بالإحالات:"
+        text = f"{title}\n\n" + ("\n".join(lines) or "لسه ما فيه أحد!") + f"\n\nترتيبك بالنقاط: #{position} من {total}"
+        send_page(chat_id, user_id, text, keyboard("leaderboard_" + by), message_id)
+        add_to_page_history(user_id, "leaderboard")
+    except Exception as e:
+        logging.error(f"فشل في عرض المتصدرين لـ {user_id}: {e}")
+
+def admin_users_menu(chat_id, user_id, order="points", after=None, message_id=None):
+    try:
+        page = storage.page_users(order, after, ADMIN_PAGE_SIZE + 1)
+        
+        next_button = None
+        if len(page) > ADMIN_PAGE_SIZE:
+            last_uid, last_user = page[ADMIN_PAGE_SIZE - 1]
+            cursor = f"admin_users_p_{last_user['points']}_{last_uid}" if order == "points" else f"admin_users_i_{last_uid}"
+            next_button = button("التالي ➡️", cursor)
+        markup = Keyboard(
+            *[row(button(f"ID: {uid} - نقاط: {user_data['points']}", f"view_user_{uid}")) for uid, user_data in page[:ADMIN_PAGE_SIZE]],
+            *nav_row(
+                button("⏮ الأول", "admin_users" if order == "points" else "admin_users_id") if after is not None else None,
+                next_button
+            ),
+            ADMIN_USERS_ORDER_ROWS[order],
+            BACK_ROW
+        )
+        
+        send_page(chat_id, user_id, "👤 إدارة المستخدمين:", markup, message_id)
+        add_to_page_history(user_id, "admin_users")
+    except Exception as e:
+        logging.error(f"فشل في عرض المستخدمين للأدمن لـ {user_id}: {e}")
+
+# معالجة الأوامر
+@bot.message_handler(commands=['start'])
+def command_start(message):
+    log_context.route = "start"
+    try:
+        chat_id = message.chat.id
+        user_id = message.from_user.id
+        delete_previous_messages(chat_id, user_id)
+        delete_queue.put(chat_id, [message.message_id])
+        
+        args = message.text.split()
+        if len(args) > 1 and args[1].startswith("ref_"):
+            referrer_id = args[1].split("_")[1]
+            if referrer_id.isdigit() and referrer_id != str(user_id):
+                if storage.ensure_user(user_id):
+                    if storage.get_user(referrer_id) is not None:
+                        storage.add_points(referrer_id, 10, referrals=1)
+                        with outbound.priority(PRIORITY_NOTIFICATION):
+                            bot.send_message(int(referrer_id), "🎉 صديق جديد انضم برابطك! +10 نقاط")
+        
+        storage.ensure_user(user_id)
+        broadcaster.unblock(user_id)
+        
+        main_menu(chat_id, user_id)
+    except Exception as e:
+        logging.error(f"خطأ في معالجة /start لـ {user_id}: {e}")
+
+# توجيه الضغطات: مطابقة تامة عبر dict والبادئات عبر trie بدل سلسلة if/elif
+class CallbackRouter:
+    def __init__(self):
+        self.exact = {}
+        self.trie = {}
+
+    def route(self, data, admin=False):
+        def register(handler):
+            self.exact[data] = (handler, (), admin)
+            return handler
+        return register
+
+    def prefix(self, data, *types, admin=False):
+        # types أنواع المعاملات اللي بعد البادئة، مفصولة بـ "_"
+        def register(handler):
+            node = self.trie
+            for char in data:
+                node = node.setdefault(char, {})
+            node[None] = (handler, types, admin)
+            return handler
+        return register
+
+    def resolve(self, data):
+        entry = self.exact.get(data)
+        if entry is not None:
+            return entry[0], entry[2], ()
+        # أطول بادئة مسجلة تطابق النص
+        node, match, end = self.trie, None, 0
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match, end = node[None], i + 1
+        if match is None:
+            return None
+        handler, types, admin = match
+        if not types:
+            return handler, admin, ()
+        parts = data[end:].split("_")
+        if len(parts) != len(types):
+            return None
+        try:
+            args = tuple(cast(part) for cast, part in zip(types, parts))
+        except ValueError:
+            return None
+        return handler, admin, args
+
+class CallbackContext:
+    __slots__ = ("call", "chat_id", "user_id", "message_id", "session")
+
+    def __init__(self, call):
+        self.call = call
+        self.chat_id = call.message.chat.id
+        self.user_id = call.from_user.id
+        self.message_id = call.message.message_id
+        self.session = sessions.get(self.user_id)
+
+    def page(self, text, markup=None):
+        send_page(self.chat_id, self.user_id, text, markup or back_markup(), self.message_id)
+
+router = CallbackRouter()
+
+# معالجة الضغطات
+@bot.callback_query_handler(func=lambda call: True)
+def callback_handler(call):
+    user_id = call.from_user.id
+    try:
+        ctx = CallbackContext(call)
+        route = router.resolve(call.data or "")
+        if route is None:
+            ctx.page("عذرًا، هذا الخيار غير متاح!")
+            return
+        handler, admin, args = route
+        log_context.route = handler.__name__
+        if admin and user_id not in ADMIN_IDS:
+            ctx.page("🚫 متاح للأدمن فقط!")
+            return
+        handler(ctx, *args)
+    except Exception as e:
+        logging.error(f"خطأ في معالجة الضغط لـ {user_id}: {e}")
+
+@router.route("main_menu")
+def on_main_menu(ctx):
+    main_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+# الصفحات اللي يرجع لها زر "رجوع للسابقة"
+BACK_PAGES = {
+    "main_menu": lambda ctx: main_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "library": lambda ctx: library_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "my_bots": lambda ctx: my_bots_menu(ctx.chat_id, ctx.user_id, ctx.session.page, message_id=ctx.message_id),
+    "admin_panel": lambda ctx: admin_panel(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "admin_library": lambda ctx: admin_library_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "admin_view_bots": lambda ctx: admin_view_bots(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "admin_users": lambda ctx: admin_users_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "my_profile": lambda ctx: on_my_profile(ctx),
+    "leaderboard": lambda ctx: leaderboard_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id),
+    "view_bot": lambda ctx: view_bot_details(ctx.chat_id, ctx.user_id, ctx.session.inputs.get("bot_index", 0), message_id=ctx.message_id),
+}
+
+@router.route("go_back")
+def on_go_back(ctx):
+    history = ctx.session.page_history
+    if len(history) > 1:
+        history.pop()
+        BACK_PAGES.get(history[-1], on_main_menu)(ctx)
+    else:
+        on_main_menu(ctx)
+
+@router.route("my_profile")
+def on_my_profile(ctx):
+    user_data = storage.get_user(ctx.user_id) or {"points": 0, "referrals": 0}
+    user_name = ctx.call.from_user.first_name or "مستخدم"
+    username = ctx.call.from_user.username or "غير متاح"
+    points = user_data["points"]
+    referrals = user_data["referrals"]
+    rank = get_rank(points)
+    position, total = storage.user_position(ctx.user_id)
+    profile_text = (
+        f"📁 ملفك الشخصي:\n"
+        f"الاسم: {user_name}\n"
+        f"المعرف: @{username}\n"
+        f"ID: {ctx.user_id}\n"
+        f"نقاطك: {points}\n"
+        f"رتبتك: {rank}\n"
+        f"ترتيبك: #{position} من {total}\n"
+        f"إحالاتك: {referrals}"
+    )
+    ctx.page(profile_text, keyboard("my_profile"))
+    add_to_page_history(ctx.user_id, "my_profile")
+
+@router.route("leaderboard")
+def on_leaderboard(ctx):
+    leaderboard_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("leaderboard_referrals")
+def on_leaderboard_referrals(ctx):
+    leaderboard_menu(ctx.chat_id, ctx.user_id, "referrals", message_id=ctx.message_id)
+
+@router.route("library")
+@router.route("cancel_search")
+def on_library(ctx):
+    library_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("search_bots")
+def on_search_bots(ctx):
+    search_bots(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.prefix("search_page_", int)
+def on_search_page(ctx, page):
+    query = ctx.session.inputs.get("search_query")
+    if query is None:
+        search_bots(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+    else:
+        show_search_results(ctx.chat_id, ctx.user_id, query, page, message_id=ctx.message_id)
+
+@router.prefix("verified_bot_", int)
+def on_verified_bot(ctx, index):
+    show_verified_bot(ctx.chat_id, ctx.user_id, index, message_id=ctx.message_id)
+
+@router.route("add_bot")
+def on_add_bot(ctx):
+    ctx.page("📝 أرسل لينك البوت (مثال: t.me/bot):", cancel_markup())
+    ctx.session.state = "adding_bot_link"
+    add_to_page_history(ctx.user_id, "add_bot")
+
+@router.prefix("my_bots_page_", int)
+def on_my_bots_page(ctx, page):
+    my_bots_menu(ctx.chat_id, ctx.user_id, page, message_id=ctx.message_id)
+
+@router.prefix("view_bot_", int)
+def on_view_bot(ctx, bot_index):
+    ctx.session.inputs = {"bot_index": bot_index}
+    view_bot_details(ctx.chat_id, ctx.user_id, bot_index, message_id=ctx.message_id)
+
+@router.prefix("show_bot_info_", int)
+def on_show_bot_info(ctx, bot_index):
+    ctx.session.inputs = {"bot_index": bot_index}
+    show_bot_info(ctx.chat_id, ctx.user_id, bot_index, message_id=ctx.message_id)
+
+@router.prefix("edit_bot_", int)
+def on_edit_bot(ctx, bot_index):
+    ctx.session.inputs = {"bot_index": bot_index}
+    ctx.page("📝 أرسل لينك البوت الجديد (مثال: t.me/bot):", cancel_markup())
+    ctx.session.state = "editing_bot_link"
+    add_to_page_history(ctx.user_id, "edit_bot")
+
+@router.prefix("confirm_delete_bot_", int)
+def on_confirm_delete_bot(ctx, bot_index):
+    ctx.session.inputs = {"bot_index": bot_index}
+    markup = Keyboard(row(button("✅ تأكيد الحذف", f"delete_bot_{bot_index}"), button("❌ إلغاء", "cancel_delete_bot")))
+    ctx.page("⚠️ هل أنت متأكد من حذف هذا البوت؟", markup)
+    add_to_page_history(ctx.user_id, "confirm_delete_bot")
+
+@router.prefix("delete_bot_", int)
+def on_delete_bot(ctx, bot_index):
+    storage.delete_bot(ctx.user_id, bot_index)
+    ctx.page("🗑️ تم حذف البوت بنجاح!")
+
+@router.route("cancel_delete_bot")
+def on_cancel_delete_bot(ctx):
+    bot_index = ctx.session.inputs.get("bot_index", 0)
+    view_bot_details(ctx.chat_id, ctx.user_id, bot_index, message_id=ctx.message_id)
+
+@router.route("cancel_add_bot")
+def on_cancel_add_bot(ctx):
+    ctx.session.state = None
+    ctx.session.inputs = {}
+    library_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("confirm_bot_link")
+def on_confirm_bot_link(ctx):
+    bot_link = ctx.session.inputs.get("link", "")
+    ctx.page(f"📝 لينك البوت:\n{bot_link}", confirm_markup("confirm_bot_description", "edit_bot_link"))
+
+@router.route("edit_bot_link")
+def on_edit_bot_link(ctx):
+    ctx.session.state = "editing_bot_link"
+    ctx.page("📝 أرسل لينك البوت الجديد (مثال: t.me/bot):", cancel_markup())
+
+@router.route("confirm_bot_description")
+def on_confirm_bot_description(ctx):
+    bot_description = ctx.session.inputs.get("description", "")
+    ctx.page(f"📝 وصف البوت:\n{bot_description}", confirm_markup("confirm_bot_name", "edit_bot_description"))
+
+@router.route("edit_bot_description")
+def on_edit_bot_description(ctx):
+    ctx.session.state = "editing_bot_description"
+    ctx.page("📝 أرسل وصف البوت الجديد:", cancel_markup())
+
+@router.route("confirm_bot_name")
+def on_confirm_bot_name(ctx):
+    bot_name = ctx.session.inputs.get("name", "")
+    ctx.page(f"📝 اسم البوت:\n{bot_name}", confirm_markup("confirm_add_bot", "edit_bot_name"))
+
+@router.route("edit_bot_name")
+def on_edit_bot_name(ctx):
+    ctx.session.state = "editing_bot_name"
+    ctx.page("📝 أرسل اسم البوت الجديد:", cancel_markup())
+
+@router.route("confirm_add_bot")
+def on_confirm_add_bot(ctx):
+    bot_info = ctx.session.inputs
+    if "bot_index" in bot_info:  # تعديل بوت موجود
+        storage.update_bot(ctx.user_id, bot_info["bot_index"], bot_info)
+    else:  # إضافة بوت جديد
+        storage.add_bot(ctx.user_id, bot_info)
+    ctx.session.state = None
+    ctx.session.inputs = {}
+    ctx.page("✅ تمت العملية بنجاح!")
+
+@router.route("verified_bots")
+def on_verified_bots(ctx):
+    verified_bots = storage.get_verified_bots()
+    if not verified_bots:
+        ctx.page("✅ لا يوجد بوتات معتمدة!")
+    else:
+        bots_text = "\n".join([f"{i+1}. {bot['name']} - {bot['description']}" for i, bot in enumerate(verified_bots)])
+        ctx.page(f"✅ البوتات المعتمدة:\n{bots_text}")
+
+@router.route("invite_friends")
+def on_invite_friends(ctx):
+    referral_link = f"https://t.me/{api_cache.me().username}?start=ref_{ctx.user_id}"
+    user_data = storage.get_user(ctx.user_id) or {"points": 0, "referrals": 0}
+    referrals = user_data["referrals"]
+    points = user_data["points"]
+    msg_text = (
+        f"👥 رابط الدعوة الخاص بك:\n{referral_link}\n"
+        f"شارك الرابط لكسب 10 نقاط لكل صديق!\n"
+        f"إحالاتك: {referrals} | نقاطك: {points}"
+    )
+    ctx.page(msg_text)
+    add_to_page_history(ctx.user_id, "invite_friends")
+
+@router.route("tasks")
+def on_tasks(ctx):
+    ctx.page("📋 المهام المتاحة:", keyboard("tasks"))
+    add_to_page_history(ctx.user_id, "tasks")
+
+@router.route("settings")
+def on_settings(ctx):
+    ctx.page("⚙️ الإعدادات:", keyboard("settings"))
+    add_to_page_history(ctx.user_id, "settings")
+
+@router.route("about")
+def on_about(ctx):
+    ctx.page("ℹ️ بوت لإدارة الأيردروبات!")
+    add_to_page_history(ctx.user_id, "about")
+
+@router.route("complaint")
+def on_complaint(ctx):
+    ctx.page("📩 أرسل شكواك:", cancel_markup("cancel_action"))
+    ctx.session.state = "sending_complaint"
+    add_to_page_history(ctx.user_id, "complaint")
+
+@router.route("confirm_complaint")
+@router.route("edit_complaint")
+def handle_complaint_confirmation(ctx):
+    session = ctx.session
+    if ctx.call.data == "confirm_complaint":
+        storage.add_points(ctx.user_id, 10)
+        session.state = None
+        session.inputs = {}
+        ctx.page("✅ تم تسجيل شكواك وحصلت على 10 نقاط!")
+    else:
+        ctx.page("📩 أرسل شكواك مرة أخرى:", cancel_markup("cancel_action"))
+        session.state = "sending_complaint"
+
+@router.route("cancel_action")
+def on_cancel_action(ctx):
+    ctx.session.state = None
+    ctx.session.inputs = {}
+    on_main_menu(ctx)
+
+@router.route("stats")
+def on_stats(ctx):
+    totals = storage.stats.snapshot()
+    stats_text = (
+        f"📊 الإحصائيات:\n"
+        f"عدد المستخدمين: {totals['users']}\n"
+        f"عدد البوتات المضافة: {totals['bots']}\n"
+        f"عدد البوتات المعتمدة: {totals['verified']}"
+    )
+    ctx.page(stats_text)
+    add_to_page_history(ctx.user_id, "stats")
+
+@router.route("admin_panel", admin=True)
+def on_admin_panel(ctx):
+    admin_panel(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("admin_library", admin=True)
+def on_admin_library(ctx):
+    admin_library_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("admin_view_bots", admin=True)
+def on_admin_view_bots(ctx):
+    admin_view_bots(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("admin_view_bots_all", admin=True)
+def on_admin_view_all_bots(ctx):
+    admin_view_bots(ctx.chat_id, ctx.user_id, unverified_only=False, message_id=ctx.message_id)
+
+@router.prefix("admin_bots_u_", int, admin=True)
+def on_admin_bots_page(ctx, before):
+    admin_view_bots(ctx.chat_id, ctx.user_id, before, message_id=ctx.message_id)
+
+@router.prefix("admin_bots_a_", int, admin=True)
+def on_admin_all_bots_page(ctx, before):
+    admin_view_bots(ctx.chat_id, ctx.user_id, before, unverified_only=False, message_id=ctx.message_id)
+
+def series_lines(series, label_format):
+    peak = max([count for _, count in series] + [1])
+    return "\n".join(f"{time.strftime(label_format, time.gmtime(start))} {'▇' * round(8 * count / peak)} {count}" for start, count in series)
+
+@router.route("admin_stats", admin=True)
+def on_admin_stats(ctx):
+    totals = storage.stats.snapshot()
+    stats_text = (
+        f"📊 إحصائيات المشروع:\n"
+        f"المستخدمين: {totals['users']}\n"
+        f"البوتات: {totals['bots']} | المعتمدة: {totals['verified']}\n"
+        f"الإحالات: {totals['referrals']} | مجموع النقاط: {totals['points']}\n\n"
+        f"👤 مستخدمين جدد (آخر 7 أيام):\n{series_lines(storage.stats.daily_new_users(7), '%m-%d')}\n\n"
+        f"🤖 بوتات مضافة (آخر 12 ساعة، UTC):\n{series_lines(storage.stats.hourly_bots_added(12), '%H:00')}"
+    )
+    ctx.page(stats_text)
+    add_to_page_history(ctx.user_id, "admin_stats")
+
+@router.prefix("verify_bot_", int, int, admin=True)
+def on_verify_bot(ctx, uid, bot_id):
+    if storage.verify_bot(uid, bot_id) is None:
+        ctx.page("⚠️ البوت انحذف أو انعتمد قبل، حدّث القائمة.")
+        return
+    ctx.page("✅ تم اعتماد البوت!")
+
+@router.route("admin_users", admin=True)
+def on_admin_users(ctx):
+    admin_users_menu(ctx.chat_id, ctx.user_id, message_id=ctx.message_id)
+
+@router.route("admin_users_id", admin=True)
+def on_admin_users_by_id(ctx):
+    admin_users_menu(ctx.chat_id, ctx.user_id, "id", message_id=ctx.message_id)
+
+@router.prefix("admin_users_p_", int, int, admin=True)
+def on_admin_users_page(ctx, points, uid):
+    admin_users_menu(ctx.chat_id, ctx.user_id, "points", (points, uid), message_id=ctx.message_id)
+
+@router.prefix("admin_users_i_", int, admin=True)
+def on_admin_users_id_page(ctx, uid):
+    admin_users_menu(ctx.chat_id, ctx.user_id, "id", uid, message_id=ctx.message_id)
+
+@router.route("admin_clean", admin=True)
+def on_admin_clean(ctx):
+    sessions.clear_messages()
+    ctx.page("🗑️ تم تنظيف الرسائل!")
+
+@router.route("admin_broadcast", admin=True)
+def on_admin_broadcast(ctx):
+    if broadcaster.running():
+        ctx.page("📣 فيه رسالة جماعية شغالة، تقدمها يظهر في رسالة التقدم.")
+        return
+    ctx.session.state = "writing_broadcast"
+    ctx.page("📣 أرسل نص الرسالة اللي توصل لكل المستخدمين:", cancel_markup("cancel_action"))
+
+@router.route("confirm_broadcast", admin=True)
+def on_confirm_broadcast(ctx):
+    text = ctx.session.inputs.get("broadcast")
+    ctx.session.state = None
+    ctx.session.inputs = {}
+    if not text:
+        ctx.page("عذرًا، انتهت الجلسة! أرسل الرسالة من جديد.")
+        return
+    try:
+        started = broadcaster.begin(text, ctx.chat_id)
+    except Exception as e:
+        logging.error(f"خطأ في بدء الرسالة الجماعية: {e}")
+        ctx.page("⚠️ ما قدرنا نبدأ الإرسال، حاول مرة ثانية.")
+        return
+    if started:
+        ctx.page("📣 بدأ الإرسال، التقدم يظهر في رسالة منفصلة.")
+    else:
+        ctx.page("📣 فيه رسالة جماعية شغالة، انتظر لين تخلص.")
+
+@router.route("admin_broadcast_pause", admin=True)
+def on_admin_broadcast_pause(ctx):
+    broadcaster.pause()
+
+@router.route("admin_broadcast_resume", admin=True)
+def on_admin_broadcast_resume(ctx):
+    broadcaster.resume()
+    broadcaster.report()
+
+@router.route("admin_broadcast_status", admin=True)
+def on_admin_broadcast_status(ctx):
+    broadcaster.report()
+
+@router.prefix("admin_", admin=True)
+def on_admin_other(ctx):
+    ctx.page("⚙️ تحت التطوير!")
+
+# معالجة الإدخال
+@bot.message_handler(func=lambda message: True)
+def handle_user_input(message):
+    try:
+        user_id = message.from_user.id
+        chat_id = message.chat.id
+        text = message.text
+        session = sessions.get(user_id)
+        log_context.route = session.state
+        delete_queue.put(chat_id, [message.message_id])
+        
+        if session.state is not None:
+            state = session.state
+            
+            if state == "searching_bots":
+                session.state = None
+                show_search_results(chat_id, user_id, text)
+            elif state == "adding_bot_link":
+                session.inputs["link"] = text
+                session.state = "adding_bot_description"
+                send_page(chat_id, user_id, "📝 أرسل وصف البوت:", cancel_markup())
+            elif state == "adding_bot_description":
+                session.inputs["description"] = text
+                session.state = "adding_bot_name"
+                send_page(chat_id, user_id, "📝 أرسل اسم البوت:", cancel_markup())
+            elif state == "adding_bot_name":
+                session.inputs["name"] = text
+                markup = confirm_markup("confirm_bot_link", "edit_bot_link")
+                send_page(chat_id, user_id, f"📝 لينك البوت:\n{session.inputs['link']}", markup)
+            elif state == "editing_bot_link":
+                session.inputs["link"] = text
+                markup = confirm_markup("confirm_bot_description", "edit_bot_link")
+                send_page(chat_id, user_id, f"📝 لينك البوت المعدل:\n{text}", markup)
+                session.state = "editing_bot_description"
+            elif state == "editing_bot_description":
+                session.inputs["description"] = text
+                markup = confirm_markup("confirm_bot_name", "edit_bot_description")
+                send_page(chat_id, user_id, f"📝 وصف البوت المعدل:\n{text}", markup)
+                session.state = "editing_bot_name"
+            elif state == "editing_bot_name":
+                session.inputs["name"] = text
+                markup = confirm_markup("confirm_add_bot", "edit_bot_name")
+                send_page(chat_id, user_id, f"📝 اسم البوت المعدل:\n{text}", markup)
+            elif state == "writing_broadcast":
+                session.inputs = {"broadcast": text}
+                markup = confirm_markup("confirm_broadcast", "admin_broadcast", "cancel_action")
+                send_page(chat_id, user_id, f"📣 الرسالة الجماعية:\n{text}\n\nتوصل لـ {storage.count_users()} مستخدم تقريبًا.", markup)
+            elif state == "sending_complaint":
+                session.inputs = {"complaint": text}
+                markup = confirm_markup("confirm_complaint", "edit_complaint", "cancel_action")
+                send_page(chat_id, user_id, f"📩 شكواك:\n{text}", markup)
+    except Exception as e:
+        logging.error(f"خطأ في معالجة الإدخال لـ {user_id}: {e}")
+
+# استقبال التحديثات عبر webhook بدل long polling
+INGRESS = os.getenv("INGRESS", "polling")  # polling أو webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # الرابط العام اللي يرسل له تيليجرام (بدونه ما نسجل webhook، مفيد للتجربة المحلية)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")  # خلف reverse proxy؛ 0.0.0.0 للاستقبال المباشر من تيليجرام
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# بدون سر أي أحد يوصل للمنفذ يقدر يرسل تحديثات مزورة (حتى باسم الأدمن)، فلو ما انحدد نولد واحد
+# ونسجله مع الـ webhook عند تيليجرام
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or (secrets.token_urlsafe(32) if WEBHOOK_URL else "")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+webhook_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+
+def webhook_app(environ, start_response):
+    # نرد على تيليجرام فورًا ونترك المعالجة لخيط منفصل
+    def respond(status, body=b""):
+        start_response(status, [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    if environ.get("PATH_INFO") != WEBHOOK_PATH:
+        return respond("404 Not Found")
+    if environ.get("REQUEST_METHOD") != "POST":
+        return respond("405 Method Not Allowed")
+    secret = environ.get("HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN", "")
+    if not hmac.compare_digest(secret.encode("latin-1"), WEBHOOK_SECRET.encode("utf-8")):
+        return respond("403 Forbidden")
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length <= 0 or length > WEBHOOK_MAX_BODY:
+        return respond("400 Bad Request")
+    body = environ["wsgi.input"].read(length)
+    try:
+        webhook_queue.put_nowait(body)
+    except queue.Full:
+        # تيليجرام يعيد المحاولة لاحقًا لما نرد بخطأ
+        logging.warning("طابور الـ webhook ممتلئ")
+        return respond("503 Service Unavailable")
+    return respond("200 OK", b"ok")
+
+def webhook_worker():
+    while True:
+        body = webhook_queue.get()
+        try:
+            if cluster:
+                cluster.dispatch(json.loads(body))
+                continue
+            update = telebot.types.Update.de_json(body.decode("utf-8"))
+            bot.process_new_updates([update])
+        except Exception as e:
+            logging.error(f"خطأ في معالجة تحديث الـ webhook: {e}")
+        finally:
+            webhook_queue.task_done()
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def run_webhook():
+    if not WEBHOOK_SECRET:
+        logging.error("وضع webhook يحتاج WEBHOOK_SECRET أو WEBHOOK_URL")
+        print("❌ وضع webhook يحتاج WEBHOOK_SECRET (أو WEBHOOK_URL عشان يتولد سر ويتسجل عند تيليجرام)")
+        exit()
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    server = make_server(WEBHOOK_HOST, WEBHOOK_PORT, webhook_app, ThreadingWSGIServer, QuietWSGIRequestHandler)
+    logging.info(f"webhook يستمع على {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    server.serve_forever()
+
+# وضع العنقود: عملية قائد وحدة تستقبل التحديثات (polling أو webhook) وتوزعها حسب المستخدم
+# على CLUSTER_WORKERS عملية، كل وحدة فيها نفس خيوط العمال. المستخدم ثابت على عامل واحد،
+# فجلسته (وحدود الإرسال لشاته) تبقى محلية، والبيانات المشتركة في SQLite (WAL يسمح بعدة عمليات)
+def worker_file(path, index):
+    root, ext = os.path.splitext(path)
+    return f"{root}-{index}{ext}"
+
+def cluster_worker(index, updates, acks):
+    # Ctrl+C يوصل لكل المجموعة؛ القائد هو اللي يوقف العمال بالترتيب. SIGTERM (systemd يرسله لكل العمليات)
+    # يوقف العامل بنفس الترتيب، ولو القائد ما طلب الإيقاف يعيد تشغيله ويرسل له اللي ما تأكد
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    update_log.acks = acks
+    start_services()
+    logging.info(f"العامل {index} جاهز")
+    leader = os.getppid()
+    while not stopping.is_set():
+        try:
+            update = updates.get(timeout=1)
+        except queue.Empty:
+            # القائد طاح بدون ما يوقفنا: اللي ما تأكد عنده يرجع يوصل من تيليجرام للقائد الجديد
+            if os.getppid() != leader:
+                logging.warning(f"القائد توقف، إيقاف العامل {index}")
+                break
+            continue
+        if update is None:
+            break
+        try:
+            bot.process_new_updates([telebot.types.Update.de_json(update)])
+        except Exception as e:
+            logging.error(f"خطأ في معالجة تحديث في العامل {index}: {e}")
+    if not bot.join_workers(SHUTDOWN_TIMEOUT):
+        logging.warning(f"العامل {index} توقف قبل ما تخلص كل التحديثات")
+    storage.close()
+    sessions.save()
+
+# القائد ما يعتبر التحديث منفذ (ولا يتقدم الـ offset عند تيليجرام) إلا لما يرجع تأكيده من العامل،
+# فلو طاح القائد يرجع يوصل من تيليجرام، ولو طاح عامل ينعاد اللي عنده للعامل الجديد
+class ClusterLeader:
+    def __init__(self, num_workers):
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.queues = [self.context.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(num_workers)]
+        self.acks = [self.context.Queue() for _ in range(num_workers)]
+        self.assigned = [{} for _ in range(num_workers)]  # لكل عامل: معرف التحديث -> التحديث، لين يوصل تأكيده
+        self.workers = [None] * num_workers
+        self.stopping = False
+
+    def spawn(self, index):
+        # العامل يقرأ إعداداته من البيئة عند الاستيراد: ملفات منفصلة لكل عامل وحصته من الحد العام
+        overrides = {
+            "CLUSTER_WORKER": str(index),
+            "LOG_FILE": worker_file(LOG_FILE, index),
+            "STATS_FILE": worker_file(STATS_FILE, index),
+            "UPDATE_STATE_FILE": worker_file(UPDATE_STATE_FILE, index),
+            "BROADCAST_FILE": worker_file(BROADCAST_FILE, index),
+            "METRICS_PORT": str(METRICS_PORT + 1 + index if METRICS_PORT else 0),
+            "GLOBAL_RATE": str(GLOBAL_RATE / len(self.workers)),
+        }
+        if SESSION_FILE:
+            overrides["SESSION_FILE"] = worker_file(SESSION_FILE, index)
+        saved = {key: os.environ.get(key) for key in overrides}
+        os.environ.update(overrides)
+        try:
+            process = self.context.Process(target=cluster_worker, args=(index, self.queues[index], self.acks[index]),
+                                           name=f"ClusterWorker-{index}", daemon=True)
+            process.start()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        self.workers[index] = process
+        logging.info(f"تم تشغيل العامل {index} (pid {process.pid})")
+
+    def respawn(self, index):
+        # طوابير جديدة: العامل الميت ممكن طاح وهو ماسك قفل الطابور القديم. اللي أرسلناه له وما تأكد
+        # (بالطابور أو كان ينفذ) ينعاد بنفس الترتيب، والعامل الجديد يتجاهل اللي نفذه قبل من ملفه
+        with self.lock:
+            self.queues[index] = self.context.Queue(maxsize=WORKER_QUEUE_SIZE)
+            self.acks[index] = self.context.Queue()
+            self.spawn(index)
+            pending = list(self.assigned[index].values())
+            for update in pending:
+                self.queues[index].put(update)
+        if pending:
+            logging.info(f"إعادة {len(pending)} تحديث للعامل {index}")
+
+    def supervise(self):
+        while True:
+            time.sleep(5)
+            for index, process in enumerate(self.workers):
+                if not process.is_alive() and not self.stopping:
+                    logging.error(f"العامل {index} توقف (exit code {process.exitcode})، إعادة تشغيله")
+                    self.respawn(index)
+
+    def collect_acks(self, index):
+        while True:
+            acks = self.acks[index]
+            try:
+                update_id = acks.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self.lock:
+                if acks is not self.acks[index]:
+                    continue
+                self.assigned[index].pop(update_id, None)
+            update_log.finish(update_id)
+
+    def start(self):
+        if STORAGE_BACKEND != "sqlite":
+            logging.error("وضع العنقود يحتاج STORAGE_BACKEND=sqlite")
+            print("❌ وضع العنقود يحتاج STORAGE_BACKEND=sqlite (ملفات JSON ما تنفع لأكثر من عملية)")
+            exit()
+        update_log.start()
+        outbound.start()
+        metrics.start()
+        for index in range(len(self.workers)):
+            self.spawn(index)
+            threading.Thread(target=self.collect_acks, args=(index,), name=f"ClusterAcks-{index}", daemon=True).start()
+        threading.Thread(target=self.supervise, name="ClusterSupervisor", daemon=True).start()
+        if INGRESS == "webhook":
+            threading.Thread(target=webhook_worker, name="WebhookWorker", daemon=True).start()
+        atexit.register(self.stop)
+
+    def dispatch(self, update):
+        # التكرار يتجاهل عند الاستلام (تيليجرام يرجع يرسل اللي ما تأكد)، والتنفيذ يتسجل لما يوصل التأكيد
+        update_id = update["update_id"]
+        if update_log.seen(update_id):
+            return
+        update_log.begin(update_id)
+        payload = next((value for key, value in update.items() if key != "update_id" and isinstance(value, dict)), {})
+        index = (payload.get("from") or {}).get("id", 0) % len(self.queues)
+        with self.lock:
+            self.assigned[index][update_id] = update
+            updates = self.queues[index]
+        while True:
+            try:
+                updates.put(update, timeout=1)
+                return
+            except queue.Full:
+                with self.lock:
+                    # العامل انعاد تشغيله والتحديث انضاف لطابوره الجديد مع الباقين
+                    if updates is not self.queues[index]:
+                        return
+
+    def poll(self, timeout=20):
+        # مثل ShardedTeleBot.get_updates: نطلب من أقدم تحديث ما تأكد من العمال
+        while True:
+            offset = update_log.offset()
+            updates = apihelper.get_updates(TOKEN, offset=offset, timeout=timeout, long_polling_timeout=timeout)
+            waiting = bool(updates) and all(update_log.pending(update["update_id"]) for update in updates)
+            for update in updates:
+                self.dispatch(update)
+            if waiting:
+                update_log.wait_for_progress(offset, 1)
+
+    def stop(self):
+        self.stopping = True
+        for update_queue, process in zip(self.queues, self.workers):
+            try:
+                update_queue.put_nowait(None)
+            except queue.Full:
+                # الطابور ممتلئ أو العامل ميت وما أحد يسحب منه: SIGTERM يوقفه بنفس الترتيب (يخلص طوابيره ويحفظ)
+                process.terminate()
+        for process in self.workers:
+            process.join(SHUTDOWN_TIMEOUT + 2)
+
+cluster = ClusterLeader(CLUSTER_WORKERS) if CLUSTER_WORKERS and CLUSTER_WORKER is None else None
+
+def request_shutdown(signum, frame):
+    # SIGTERM (systemd stop أو docker stop) بدون معالج ينهي العملية بدون atexit، فيضيع اللي بالمخزن المؤقت
+    # والجلسات والإحصائيات وحالة التحديثات. نحوله لنفس مسار Ctrl+C، ومرة وحدة بس عشان ما يقطع الحفظ
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    if cluster:
+        # systemd يرسل SIGTERM للعمال كمان، فما نعيد تشغيلهم لما يوقفوا
+        cluster.stopping = True
+    raise KeyboardInterrupt
+
+def drain_updates():
+    # بعد ما يوقف الاستلام: نخلص اللي بطابور الـ webhook وطوابير العمال قبل الحفظ (atexit). اللي ما يلحق
+    # بالمهلة ما يتأكد في polling، فيرجع يوصل من تيليجرام بعد التشغيل
+    deadline = time.time() + SHUTDOWN_TIMEOUT
+    if not join_queue(webhook_queue, SHUTDOWN_TIMEOUT) or not bot.join_workers(max(0, deadline - time.time())):
+        logging.warning("انتهت مهلة الإيقاف قبل ما تخلص كل التحديثات")
+
+# تشغيل البوت
+def run_bot():
+    signal.signal(signal.SIGTERM, request_shutdown)
+    if cluster:
+        cluster.start()
+    else:
+        start_services()
+    while True:
+        try:
+            print("البوت شغال...")
+            logging.info("بدء تشغيل البوت...")
+            if INGRESS == "webhook":
+                run_webhook()
+            elif cluster:
+                cluster.poll()
+            else:
+                # get_updates يكمل من update_log.offset(): أقدم تحديث ما خلص قبل الإيقاف
+                bot.polling(non_stop=True, interval=1, timeout=20)
+            # polling يرجع بدون خطأ بس لما ينوقف (Ctrl+C)، فما نعيد تشغيله
+            break
+        except KeyboardInterrupt:
+            logging.info("تم إيقاف البوت")
+            break
+        except (ConnectionError, ReadTimeout) as e:
+            logging.error(f"خطأ في الاتصال: {e}")
+            time.sleep(5)
+        except Exception as e:
+            logging.error(f"خطأ غير متوقع: {e}")
+            time.sleep(5)
+    # العنقود يوقف عماله بـ atexit (ClusterLeader.stop)، وكل عامل يخلص طوابيره بنفسه
+    if not cluster:
+        drain_updates()
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        # تحويل يدوي لمرة وحدة: python جديد.py migrate
+        if not migrate_legacy_data():
+            print(f"ما فيه شي للتحويل ({LEGACY_DATA_FILE} غير موجود أو {DATA_FILE} موجود)")
+    else:
+        run_bot()
\ No newline at end of file